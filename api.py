@@ -1,40 +1,438 @@
-import requests
+import base64
+import codecs
+import contextvars
+import hashlib
+import json
+import math
 import os
+import re
+import threading
+import time
 
-# these are AWS environment variables - set them for your OpenHAB installation
-hostname = os.environ['hostname']
-port = os.environ['port']
-user = os.environ['user']
-password = os.environ['password']
+from breaker import CircuitBreaker, CircuitOpen, breaker_cooldown, breaker_threshold
+from deadline import DeadlineExceeded, budget, check, remaining, together
+from metrics import get_metrics
+from tools import from_json
+
+# Importing requests takes longer than the rest of this project put together, so it is left until
+# the first call to OpenHAB - the same goes for the AWS environment variables describing it.
+
+# Optional tuning: the number of keep-alive connections held open to OpenHAB,
+# and how many seconds a single HTTP call may take before it is abandoned.
+pool_size = int(os.environ.get('pool_size', 4))
+timeout = float(os.environ.get('timeout', 5))
+# Optional: milliseconds to wait for OpenHAB to answer a read before asking again on another connection,
+# taking whichever answer comes first (default 0, off). Commands are never sent twice.
+hedge_ms = float(os.environ.get('hedge_ms', 0))
+
+# Optional: names of several OpenHAB instances to use at once, e.g. "house,garage". Each is described by its own
+# AWS environment variables, named after it - house_hostname, house_port, house_user and house_password.
+# Their devices are discovered as "house:Light" and so on, and directives go to the instance named.
+# Without it, the single instance described by hostname, port, user and password is used.
+backends = [backend.strip() for backend in os.environ.get('backends', '').split(',') if backend.strip()] or ['']
+# Between the name of an instance and an item in the applianceId - OpenHAB doesn't allow it in item names.
+separator = ':'
+# The instance the directive being handled by this thread or task is for.
+current_backend = contextvars.ContextVar('backend', default=backends[0])
+
+
+# A pooled, keep-alive connection to a single OpenHAB instance.
+# AWS keeps the module loaded between warm invocations, so the session (and its open sockets)
+# is reused from one directive to the next and the TCP handshake is only paid on a cold start.
+class OpenHABClient:
+    def __init__(self, hostname, port, user, password, pool_size=4, timeout=5.0):
+        self.root_url = "http://" + hostname + ":" + str(port) + "/rest/"
+        self.base_url = self.root_url + "items/"
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.timeout = timeout
+        # What a failed call raises, for callers that haven't imported requests themselves.
+        self.errors = (requests.exceptions.RequestException, DeadlineExceeded, CircuitOpen)
+        self.timeouts = requests.exceptions.Timeout
+        # Shared by every invocation, so once OpenHAB is known to be down directives fail without waiting on it.
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.session = requests.Session()
+        # Build the basic auth header once rather than letting requests re-encode it on every call.
+        credentials = base64.b64encode((user + ":" + password).encode('utf-8')).decode('ascii')
+        self.session.headers['Authorization'] = "Basic " + credentials
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    # Sends a plain text command to an item.
+    def post(self, name, value, timeout=None):
+        return self.request('POST', name, data=value.encode('utf-8'), headers={'Content-Type': 'text/plain'},
+                            timeout=timeout)
+
+    # Reads an item, or every item when name is empty.
+    def get(self, name, params=None, headers=None, stream=False, timeout=None):
+        return self.request('GET', name, params=params, headers=headers, stream=stream, timeout=timeout)
+
+    # Makes a call for an item, recording how it went in the invocation's metrics.
+    # The call may take no longer than its share of what the invocation has left - see deadline.py.
+    def request(self, method, name, stream=False, timeout=None, **kwargs):
+        metrics = get_metrics()
+        limit = timeout or self.timeout
+        try:
+            timeout = budget(limit)
+        except DeadlineExceeded:
+            metrics.add('DeadlineExceeded')
+            raise
+        if not self.breaker.allow():
+            metrics.add('CircuitOpen')
+            raise CircuitOpen("OpenHAB is unreachable")
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.base_url + name, stream=stream, timeout=timeout, **kwargs)
+        except self.errors as e:
+            # running out of the invocation's time doesn't mean OpenHAB is down
+            if isinstance(e, self.timeouts) and timeout < limit:
+                self.breaker.abandoned()
+            else:
+                self.breaker.failed()
+            metrics.http(method, name, 0, 0, time.perf_counter() - start)
+            raise
+        # a missing item still means OpenHAB is up - only its own failures count
+        if resp.status_code >= 500:
+            self.breaker.failed()
+        else:
+            self.breaker.succeeded()
+        # a streamed body hasn't been read yet, so go by what OpenHAB says it will send
+        size = int(resp.headers.get('Content-Length', 0)) if stream else len(resp.content)
+        metrics.http(method, name, resp.status_code, size, time.perf_counter() - start)
+        return resp
+
+    # Opens OpenHAB's server-sent event stream, limited to the given topics.
+    # idle is how many seconds to wait for the next event before giving up on the connection.
+    def events(self, topics, idle=None):
+        return self.session.get(self.root_url + "events", params={'topics': ','.join(topics)},
+                                headers={'Accept': 'text/event-stream'}, stream=True, timeout=(self.timeout, idle))
+
+
+# Shared by every invocation the container serves, and created on first use.
+clients = {}
+executor = None
+fanout = None
+hedges = None
+startup = threading.Lock()
+
+
+# Returns the shared client for an OpenHAB instance, by default the one the current directive is for.
+def get_client(backend=None):
+    if backend is None:
+        backend = current_backend.get()
+    with startup:
+        if backend not in clients:
+            # these are AWS environment variables - set them for your OpenHAB installation
+            prefix = backend + "_" if backend else ""
+            clients[backend] = OpenHABClient(os.environ[prefix + 'hostname'], os.environ[prefix + 'port'],
+                                             os.environ[prefix + 'user'], os.environ[prefix + 'password'],
+                                             pool_size, timeout)
+    return clients[backend]
+
+
+# Returns the applianceId for an item of an instance.
+def qualify(backend, name):
+    return backend + separator + name if backend else name
+
+
+# Splits an applianceId into the instance the item belongs to and its name there.
+# Ids without an instance name belong to the first instance.
+def locate(appliance_id):
+    backend, found, name = appliance_id.partition(separator)
+    if found and backend in backends:
+        return backend, name
+    return backends[0], appliance_id
+
+
+# Describes whether OpenHAB can be reached, as (healthy, description), going by how recent calls went.
+# OpenHAB isn't called - before the first call to an instance it is assumed to be fine.
+def health():
+    problems = []
+    for backend, client in list(clients.items()):
+        state = client.breaker.state
+        if state == 'closed':
+            continue
+        name = "OpenHAB" + (" (" + backend + ")" if backend else "")
+        if state == 'half-open':
+            problems.append(name + " is unreachable, checking whether it is back")
+        else:
+            seconds = math.ceil(client.breaker.retry_in())
+            problems.append(name + " is unreachable, checking again in %d seconds" % seconds)
+    if not problems:
+        return True, "The system is currently healthy"
+    return False, "; ".join(problems)
+
+
+# Returns the threads that the asyncio variants below wait on OpenHAB from - one per pooled connection.
+def get_executor():
+    global executor
+    with startup:
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=pool_size)
+    return executor
+
+
+# Returns the threads used by fanOut. These are kept apart from the executor above,
+# as a handler already running on one of its threads may fan out.
+def get_fanout():
+    global fanout
+    with startup:
+        if fanout is None:
+            from concurrent.futures import ThreadPoolExecutor
+            fanout = ThreadPoolExecutor(max_workers=pool_size)
+    return fanout
+
+
+# Returns the threads that hedged reads are made from. Again these are kept apart, as fanOut's threads make reads.
+def get_hedges():
+    global hedges
+    with startup:
+        if hedges is None:
+            from concurrent.futures import ThreadPoolExecutor
+            hedges = ThreadPoolExecutor(max_workers=pool_size * 2)
+    return hedges
+
+
+# Calls a function once for each set of arguments, concurrently, and returns the results in the same order.
+# Each call sees the caller's context - the same metrics, for instance - and the calls count as one planned call.
+def fanOut(function, arguments):
+    if len(arguments) < 2:
+        return [function(*args) for args in arguments]
+    pool = get_fanout()
+    context = together()
+    calls = [pool.submit(context.copy().run, function, *args) for args in arguments]
+    return [call.result() for call in calls]
 
 
 # sends commands to OpenHAB for an item via its restful interface
 # returns True for successful outcome, False for error.
 # name is the item name, value is the payload data.
 def postCommand(name, value):
+    openhab = get_client()
     try:
-        resp = requests.post("http://" + hostname + ":" + str(port) + "/rest/items/" + name,
-                             headers={'Content-Type': 'text/plain', 'Content-Length': str(len(value))}, data=value,
-                             auth=(user, password))
-    except requests.exceptions.RequestException as e:
+        resp = openhab.post(name, value)
+    except openhab.errors as e:
         print("HTTP error occured: " + str(e))
         return False
     if resp.status_code not in (200, 201):  # bad response
-        print("got bad HTTP response code:" + resp.status_code)
+        print("got bad HTTP response code:" + str(resp.status_code))
         return False
     print("Successful request made: " + name + " " + value)  # All OK
     return True
 
 
+# A read that is on its way to OpenHAB, which other threads wanting the same thing can wait for.
+class Flight:
+    def __init__(self):
+        self.landed = threading.Event()
+        self.result = False
+
+
+# Reads on their way to OpenHAB, by (function, instance, item name).
+flights = {}
+flights_lock = threading.Lock()
+
+
+# Wraps a function reading an item so that concurrent reads of the same item share a single call to OpenHAB:
+# the first caller makes it, and the others wait for and share its result.
+def coalesced(function):
+    def read(name):
+        key = (function, current_backend.get(), name)
+        with flights_lock:
+            flight = flights.get(key)
+            leading = flight is None
+            if leading:
+                flight = flights[key] = Flight()
+        if not leading:
+            flight.landed.wait()
+            return flight.result
+        try:
+            flight.result = function(name)
+        finally:
+            with flights_lock:
+                del flights[key]
+            flight.landed.set()
+        return flight.result
+    return read
+
+
+# Reads from OpenHAB. If hedge_ms is set and OpenHAB hasn't answered by then, the read is made a second time
+# and whichever answer arrives first is returned.
+def fetch(name):
+    openhab = get_client()
+    if not hedge_ms:
+        return openhab.get(name)
+    from concurrent.futures import FIRST_COMPLETED, TimeoutError, wait
+    pool = get_hedges()
+    first = pool.submit(contextvars.copy_context().run, openhab.get, name)
+    try:
+        return first.result(timeout=hedge_ms / 1000)
+    except TimeoutError:
+        pass
+    left = remaining()
+    if left is not None and left <= hedge_ms / 1000:
+        # too late for a second read to beat the first
+        return first.result()
+    get_metrics().add('HedgedCalls')
+    second = pool.submit(contextvars.copy_context().run, openhab.get, name)
+    done, _ = wait((first, second), return_when=FIRST_COMPLETED)
+    winner = done.pop()
+    loser = second if winner is first else first
+    if winner.exception() is not None:
+        # the other read may yet succeed
+        return loser.result()
+    loser.add_done_callback(discard)
+    return winner.result()
+
+
+# Releases the connection of a response nobody is waiting for.
+def discard(call):
+    if call.exception() is None:
+        call.result().close()
+
+
 # Obtains an "item" from the OpenHAB restful interface.
+@coalesced
 def getItem(name):
     try:
-        resp = requests.get("http://" + hostname + ":" + str(port) + "/rest/items/" + name, auth=(user, password))
+        resp = fetch(name)
         if resp.status_code not in (200, 201):
-            print("got bad HTTP response code:" + resp.status_code)
+            print("got bad HTTP response code:" + str(resp.status_code))
             return False
-        json = resp.json()
+        with get_metrics().span('Parse'):
+            json = from_json(resp.content)
     except Exception as e:
         print("Error: " + str(e))
         return False
     return json
+
+
+# Obtains the state of an item as plain text, which is much less to send and parse than the whole item.
+# Returns False on error.
+@coalesced
+def getState(name):
+    try:
+        resp = fetch(name + "/state")
+        if resp.status_code not in (200, 201):
+            print("got bad HTTP response code:" + str(resp.status_code))
+            return False
+        return resp.text
+    except Exception as e:
+        print("Error: " + str(e))
+        return False
+
+
+# Obtains the states of several items at once, as a list in the same order as the names.
+def getStates(names):
+    return fanOut(getState, [(name,) for name in names])
+
+
+# Turns a blocking function into a coroutine function that runs it on the shared executor,
+# so that an event loop can wait on several OpenHAB calls at once. The function sees the caller's context.
+def asynchronous(function):
+    async def run(*args):
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), contextvars.copy_context().run,
+                                                                function, *args)
+    return run
+
+
+# asyncio variants of the calls above.
+postCommandAsync = asynchronous(postCommand)
+getItemAsync = asynchronous(getItem)
+
+
+# The item fields discovery looks at - asking OpenHAB for only these leaves out states, members and metadata.
+DISCOVERY_FIELDS = ('name', 'label', 'type', 'groupType', 'tags', 'groupNames')
+
+# Whitespace and commas between the items of a JSON array.
+separators = re.compile(r'[\s,]*')
+
+
+# Iterates over the JSON array of items in a streamed response, decoding each item as soon as its
+# bytes have arrived. Only the item being read is held in memory, however many items there are.
+# After iterating, digest is a hash of the body and count the number of items read.
+class ItemStream:
+    def __init__(self, resp, chunk_size=16384):
+        self.resp = resp
+        self.chunk_size = chunk_size
+        # OpenHAB answers "304 Not Modified" when the etag we sent still matches.
+        self.not_modified = resp.status_code == 304
+        self.etag = resp.headers.get('ETag')
+        self.digest = None
+        self.count = 0
+        if self.not_modified:
+            # there's no body to read, so give the connection straight back to the pool
+            resp.close()
+
+    def __iter__(self):
+        if self.not_modified:
+            return
+        digest = hashlib.sha1()
+        text = codecs.getincrementaldecoder('utf-8')()
+        parse = json.JSONDecoder().raw_decode
+        buffer = ""
+        started = False
+        # seconds spent decoding, for the metrics
+        parsing = 0.0
+        try:
+            for chunk in self.resp.iter_content(self.chunk_size):
+                # a long list may take longer to arrive than the invocation has left
+                check()
+                digest.update(chunk)
+                buffer += text.decode(chunk)
+                pos = 0
+                if not started:
+                    pos = separators.match(buffer).end()
+                    if pos == len(buffer):
+                        continue
+                    if buffer[pos] != '[':
+                        raise ValueError("Expected a list of items")
+                    started = True
+                    pos += 1
+                while True:
+                    pos = separators.match(buffer, pos).end()
+                    if pos == len(buffer) or buffer[pos] == ']':
+                        break
+                    start = time.perf_counter()
+                    try:
+                        item, pos = parse(buffer, pos)
+                    except json.JSONDecodeError:
+                        break  # the rest of this item hasn't arrived yet
+                    finally:
+                        parsing += time.perf_counter() - start
+                    self.count += 1
+                    yield item
+                buffer = buffer[pos:]
+        finally:
+            self.resp.close()
+            get_metrics().add('Parse', parsing * 1000)
+        if not buffer.startswith(']'):
+            raise ValueError("Item list ended unexpectedly")
+        self.digest = digest.hexdigest()
+
+
+# Streams items from OpenHAB's restful interface, to be parsed one at a time as they arrive.
+# fields limits the data sent for each item, tags only returns items that have all of the given tags,
+# and etag comes from a previous stream so OpenHAB can tell us nothing has changed.
+# backend names the instance to read, by default the one the current directive is for.
+# Returns an ItemStream, or False on error.
+def streamItems(fields=None, tags=None, etag=None, backend=None):
+    params = {'recursive': 'false'}
+    if fields:
+        params['fields'] = ','.join(fields)
+    if tags:
+        params['tags'] = ','.join(tags)
+    openhab = get_client(backend)
+    try:
+        resp = openhab.get("", params=params, headers={'If-None-Match': etag} if etag else None, stream=True)
+    except openhab.errors as e:
+        print("HTTP error occured: " + str(e))
+        return False
+    if resp.status_code not in (200, 201, 304):
+        print("got bad HTTP response code:" + str(resp.status_code))
+        resp.close()
+        return False
+    return ItemStream(resp)
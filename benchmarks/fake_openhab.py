@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# A stand-in for OpenHAB's restful interface, for benchmarking without a real installation.
+#
+#   python benchmarks/fake_openhab.py --port 8081 --items 3000 --thermostats 20 --latency 5
+#
+# Serves /rest/items (with fields, tags and etags), /rest/items/{name}, /rest/items/{name}/state
+# and accepts commands posted to /rest/items/{name}. POST a JSON object of generate_items()
+# arguments (and optionally "latency", in ms) to /fake/items to replace the items without restarting.
+
+# How often each kind of item appears, by (type, tags).
+default_mix = {
+    ('Switch', ('Switchable',)): 30,
+    ('Switch', ('Lighting',)): 15,
+    ('Dimmer', ('Lighting',)): 20,
+    ('Color', ('Lighting',)): 10,
+    ('Rollershutter', ('Switchable',)): 5,
+    ('Number', ('CurrentTemperature',)): 5,
+    ('Number', ('CurrentTemperature', 'Fahrenheit')): 2,
+    ('Number', ()): 8,
+    ('String', ()): 5,
+}
+states = {'Switch': 'ON', 'Dimmer': '40', 'Color': '120,100,40', 'Rollershutter': '0', 'Number': '20.5',
+          'String': 'text'}
+
+
+# Reads a mix of items written as "Type:Tag+Tag=weight,...", e.g. "Dimmer:Lighting=20,Number=5"
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        kind, weight = part.split('=')
+        kind, _, tags = kind.partition(':')
+        mix[(kind, tuple(tags.split('+')) if tags else ())] = float(weight)
+    return mix
+
+
+# Builds a list of items in the shape OpenHAB returns them.
+# thermostats is the number of thermostat groups (of a setpoint, a temperature and a mode), and rooms the
+# number of Dimmer groups the lights are spread across. mix weights each kind of item, as in default_mix
+# or as a string for parse_mix.
+def generate_items(items=1000, thermostats=10, rooms=10, mix=None, seed=1):
+    rng = random.Random(seed)
+    mix = parse_mix(mix) if isinstance(mix, str) else mix or default_mix
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    generated = []
+    for i in range(rooms):
+        generated.append(item('Room%d' % i, 'Group', ['Lighting'], '40', group_type='Dimmer'))
+    for i in range(thermostats):
+        group = 'Thermostat%d' % i
+        generated.append(item(group, 'Group', ['Thermostat'], 'NULL'))
+        generated.append(item(group + '_Setpoint', 'Number', ['TargetTemperature'], '21', [group]))
+        generated.append(item(group + '_Temperature', 'Number', ['CurrentTemperature'], '20.5', [group]))
+        generated.append(item(group + '_Mode', 'Number', ['homekit:HeatingCoolingMode'], '1', [group]))
+    for i in range(max(items - len(generated), 0)):
+        kind, tags = rng.choices(kinds, weights)[0]
+        groups = ['Room%d' % rng.randrange(rooms)] if rooms and kind in ('Dimmer', 'Color') else []
+        generated.append(item('Item%d' % i, kind, list(tags), states[kind], groups))
+    return generated
+
+
+def item(name, kind, tags, state, groups=(), group_type=None):
+    generated = {
+        'link': 'http://openhab/rest/items/' + name,
+        'state': state,
+        'editable': False,
+        'type': kind,
+        'name': name,
+        'label': name.replace('_', ' '),
+        'category': None,
+        'tags': tags,
+        'groupNames': list(groups),
+        'metadata': {'homekit': {'value': '', 'config': {}}},
+    }
+    if group_type:
+        generated['groupType'] = group_type
+    return generated
+
+
+class FakeOpenHAB:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.load([])
+
+    def load(self, items):
+        with self.lock:
+            self.items = {entry['name']: entry for entry in items}
+            self.members = {}
+            for entry in items:
+                for group in entry['groupNames']:
+                    self.members.setdefault(group, []).append(entry['name'])
+            self.etag = '"%s"' % hashlib.sha1(str(len(items)).encode() + str(time.time()).encode()).hexdigest()
+
+    # An item as /rest/items/{name} returns it, with a group's members.
+    def full(self, name):
+        entry = dict(self.items[name])
+        if entry['type'] == 'Group':
+            entry['members'] = [self.items[member] for member in self.members.get(name, ())]
+        return entry
+
+
+def handler_for(openhab):
+    class FakeRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Send headers and body together, rather than waiting on a delayed ack in between.
+        wbufsize = -1
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body=b'', content_type='application/json', headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if openhab.latency:
+                time.sleep(openhab.latency)
+            url = urlparse(self.path)
+            if not url.path.startswith('/rest/items'):
+                return self.reply(404)
+            name = url.path[len('/rest/items'):].strip('/')
+            if not name:
+                return self.list_items(parse_qs(url.query))
+            if name.endswith('/state'):
+                name = name[:-len('/state')]
+                if name not in openhab.items:
+                    return self.reply(404)
+                return self.reply(200, openhab.items[name]['state'].encode('utf-8'), 'text/plain')
+            if name not in openhab.items:
+                return self.reply(404, b'{}')
+            self.reply(200, json.dumps(openhab.full(name)).encode('utf-8'))
+
+        def list_items(self, query):
+            if self.headers.get('If-None-Match') == openhab.etag:
+                return self.reply(304, headers={'ETag': openhab.etag})
+            items = list(openhab.items.values())
+            if 'tags' in query:
+                wanted = set(query['tags'][0].split(','))
+                items = [entry for entry in items if wanted.issubset(entry['tags'])]
+            if 'fields' in query:
+                fields = query['fields'][0].split(',')
+                items = [{field: entry[field] for field in fields if field in entry} for entry in items]
+            elif query.get('recursive', ['true'])[0] != 'false':
+                items = [openhab.full(entry['name']) for entry in items]
+            self.reply(200, json.dumps(items).encode('utf-8'), headers={'ETag': openhab.etag})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+            if self.path == '/fake/items':
+                config = json.loads(body)
+                openhab.latency = config.pop('latency', openhab.latency * 1000.0) / 1000.0
+                openhab.load(generate_items(**config))
+                return self.reply(200, b'{}')
+            if openhab.latency:
+                time.sleep(openhab.latency)
+            name = self.path[len('/rest/items/'):]
+            if not self.path.startswith('/rest/items/') or name not in openhab.items:
+                return self.reply(404)
+            openhab.items[name]['state'] = body
+            self.reply(200)
+
+    return FakeRequestHandler
+
+
+# Starts a fake OpenHAB in a background thread, returning (server, FakeOpenHAB).
+def serve(port=0, latency=0.0, **generate):
+    openhab = FakeOpenHAB(latency)
+    openhab.load(generate_items(**generate))
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler_for(openhab))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, openhab
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake OpenHAB restful interface")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--thermostats', type=int, default=10)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--mix', help="item kinds and weights, e.g. Dimmer:Lighting=20,Switch:Switchable=30")
+    parser.add_argument('--latency', type=float, default=0.0, help="milliseconds added to every request")
+    args = parser.parse_args()
+    server, _ = serve(args.port, args.latency / 1000.0, items=args.items, thermostats=args.thermostats,
+                      rooms=args.rooms, mix=args.mix)
+    print("Listening on 127.0.0.1:%d" % server.server_address[1], flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+
+from fake_openhab import generate_items
+
+# Drives lambda_handler against a fake OpenHAB (see fake_openhab.py, run as a separate process so it
+# doesn't share this one's CPU or memory) and reports latency, throughput and peak memory per directive.
+#
+#   python benchmarks/latency.py --items 100,1000,10000 --iterations 200 --latency 2
+#
+# "discovery" rebuilds the device list every time, while "discovery-revalidate" is what a cached
+# device list costs once it has expired and OpenHAB reports nothing has changed. "discovery-incremental" reads
+# every item again but finds none changed, as when OpenHAB sends no etag or something else in it changed.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+# Directives as the Echo sends them, by the kind of item they are aimed at.
+def directive(namespace, name, appliance, **payload):
+    payload['appliance'] = {'applianceId': appliance, 'additionalApplianceDetails': {}}
+    return {
+        'header': {'namespace': 'Alexa.ConnectedHome.' + namespace, 'name': name, 'payloadVersion': '2',
+                   'messageId': '3b2d1a8e-0c5a-4a7e-9f55-bench'},
+        'payload': payload
+    }
+
+
+def directives(items):
+    def first(kind, tag):
+        return next(entry['name'] for entry in items if entry['type'] == kind and tag in entry['tags'])
+
+    switch = first('Switch', 'Switchable')
+    dimmer = first('Dimmer', 'Lighting')
+    colour = first('Color', 'Lighting')
+    thermostat = first('Group', 'Thermostat')
+    room = next((entry['name'] for entry in items if entry.get('groupType') == 'Dimmer'), dimmer)
+    return {
+        'discovery': {'header': {'namespace': 'Alexa.ConnectedHome.Discovery', 'name': 'DiscoverAppliancesRequest',
+                                 'payloadVersion': '2', 'messageId': '6d6d6e14-8aee-473e-8c24-bench'},
+                      'payload': {'accessToken': 'bench'}},
+        'switch': directive('Control', 'TurnOnRequest', switch),
+        'percentage-set': directive('Control', 'SetPercentageRequest', dimmer, percentageState={'value': 50.0}),
+        'percentage-increment': directive('Control', 'IncrementPercentageRequest', dimmer,
+                                          deltaPercentage={'value': 1.0}),
+        'percentage-group': directive('Control', 'IncrementPercentageRequest', room, deltaPercentage={'value': 1.0}),
+        'colour': directive('Control', 'SetColorRequest', colour,
+                            color={'hue': 350.5, 'saturation': 0.7138, 'brightness': 0.6524}),
+        'thermostat-reading': directive('Query', 'GetTemperatureReadingRequest', thermostat),
+        'thermostat-target': directive('Query', 'GetTargetTemperatureRequest', thermostat),
+        'thermostat-set': directive('Control', 'SetTargetTemperatureRequest', thermostat,
+                                    targetTemperature={'value': 21.0}),
+        'thermostat-increment': directive('Control', 'IncrementTargetTemperatureRequest', thermostat,
+                                          deltaTemperature={'value': 1.0}),
+    }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+# Runs one directive repeatedly, returning (latencies in seconds, errors, peak memory in bytes).
+def measure(handler, event, iterations, before=None):
+    latencies = []
+    errors = 0
+    for _ in range(iterations):
+        if before:
+            before()
+        start = time.perf_counter()
+        try:
+            response = handler(event, None)
+            failed = response['header']['name'].endswith('Error')
+        except Exception:
+            failed = True
+        latencies.append(time.perf_counter() - start)
+        errors += failed
+    # memory is traced separately, as tracing slows everything else down
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        handler(event, None)
+    except Exception:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latencies, errors, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the handlers against a fake OpenHAB")
+    parser.add_argument('--items', default='100,1000,10000', help="comma separated item counts to test")
+    parser.add_argument('--thermostats', type=int, default=10)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--mix', help="item kinds and weights, see fake_openhab.py")
+    parser.add_argument('--latency', type=float, default=0.0, help="milliseconds OpenHAB takes per request")
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--port', type=int, default=18081)
+    parser.add_argument('--only', help="comma separated directives to run, e.g. discovery,switch")
+    parser.add_argument('--group-fanout', action='store_true', help="change a group's members one by one")
+    args = parser.parse_args()
+
+    fake = subprocess.Popen([sys.executable, os.path.join(here, 'fake_openhab.py'), '--port', str(args.port),
+                             '--items', '0'], stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        fake.stdout.readline()  # wait until it is listening
+        os.environ.update(hostname='127.0.0.1', port=str(args.port), user='bench', password='bench',
+                          discovery_ttl='0', discovery_max_stale='0', group_fanout='1' if args.group_fanout else '')
+        sys.path.insert(0, root)
+        from entrypoint import lambda_handler
+        import smarthome
+
+        # Forgets the cached device list, so that discovery rebuilds it.
+        def forget():
+            for cache in smarthome.discovery_caches.values():
+                cache.devices = None
+                cache.etag = None
+                cache.catalog.entries = {}
+
+        # Forgets that OpenHAB's items were seen, but not what they were made into.
+        def expire():
+            for cache in smarthome.discovery_caches.values():
+                cache.etag = None
+                cache.digest = None
+
+        for count in (int(n) for n in args.items.split(',')):
+            config = {'items': count, 'thermostats': args.thermostats, 'rooms': args.rooms, 'mix': args.mix}
+            request = urllib.request.Request('http://127.0.0.1:%d/fake/items' % args.port,
+                                             json.dumps(dict(config, latency=args.latency)).encode('utf-8'))
+            urllib.request.urlopen(request).read()
+            events = directives(generate_items(**config))
+            runs = [(name, events[name], forget if name == 'discovery' else None) for name in events]
+            runs.insert(1, ('discovery-revalidate', events['discovery'], None))
+            runs.insert(2, ('discovery-incremental', events['discovery'], expire))
+            if args.only:
+                runs = [run for run in runs if run[0] in args.only.split(',')]
+
+            print("\n%d items, %.1f ms OpenHAB latency" % (count, args.latency))
+            print("%-22s %9s %9s %9s %9s %10s %7s" % ('directive', 'p50 ms', 'p95 ms', 'p99 ms', 'ops/s',
+                                                      'peak KiB', 'errors'))
+            for name, event, before in runs:
+                # keep the handlers' own logging out of the report
+                with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+                    measure(lambda_handler, event, 3, before)  # warm up
+                    latencies, errors, peak = measure(lambda_handler, event, args.iterations, before)
+                ordered = sorted(latencies)
+                print("%-22s %9.2f %9.2f %9.2f %9.1f %10.1f %7d" % (
+                    name, percentile(ordered, 0.5) * 1000, percentile(ordered, 0.95) * 1000,
+                    percentile(ordered, 0.99) * 1000, len(latencies) / sum(latencies), peak / 1024.0, errors))
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == '__main__':
+    main()
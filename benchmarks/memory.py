@@ -0,0 +1,73 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from fake_openhab import generate_items
+
+# Compares the memory taken by OpenHAB's items kept as the dicts their JSON decodes to, against the Items of
+# items.py - as the state mirror keeps every item, and discovery reads every item.
+#
+#   python benchmarks/memory.py --items 1000,10000,50000
+#
+# "held" is what the items take once read, and "peak" the most in use while reading them.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from api import DISCOVERY_FIELDS  # noqa: E402
+import items  # noqa: E402
+
+
+def as_dicts(body):
+    return {item['name']: item for item in json.loads(body)}
+
+
+def as_items(body):
+    return {item.name: item for item in map(items.compact, json.loads(body))}
+
+
+# Reads the items from a JSON body, returning (seconds, bytes held afterwards, peak bytes).
+def measure(read, body):
+    # start each run without the tuples shared by the last one
+    items.shared.clear()
+    items.shared[()] = ()
+    gc.collect()
+    start = time.perf_counter()
+    read(body)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    held = read(body)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return seconds, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory taken by items as dicts and as Items")
+    parser.add_argument('--items', default='1000,10000,50000', help="comma separated item counts to test")
+    parser.add_argument('--thermostats', type=int, default=10)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--mix', help="item kinds and weights, see fake_openhab.py")
+    args = parser.parse_args()
+
+    print("%8s %-6s %10s %10s %10s %10s" % ('items', 'as', 'read ms', 'held KiB', 'peak KiB', 'bytes/item'))
+    for count in (int(n) for n in args.items.split(',')):
+        generated = generate_items(count, args.thermostats, args.rooms, args.mix)
+        # what the state mirror reads from OpenHAB
+        body = json.dumps([{field: item[field] for field in DISCOVERY_FIELDS + ('state',) if field in item}
+                           for item in generated])
+        results = {}
+        for name, read in (('dicts', as_dicts), ('Items', as_items)):
+            seconds, held, peak = results[name] = measure(read, body)
+            print("%8d %-6s %10.2f %10.1f %10.1f %10.0f" % (count, name, seconds * 1000, held / 1024.0,
+                                                           peak / 1024.0, held / float(count)))
+        print("%8s %-6s Items hold %.1f times less" % ('', '', results['dicts'][1] / float(results['Items'][1])))
+
+
+if __name__ == '__main__':
+    main()
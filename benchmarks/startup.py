@@ -0,0 +1,70 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures how long a cold start spends importing, using fresh interpreters and python -X importtime.
+#
+#   python benchmarks/startup.py --repeat 10 --budget entrypoint=25 --budget smarthome=60 --budget handlers=60
+#
+# Each stage is what a cold start imports before it can do that kind of work:
+#   entrypoint - enough to answer a health check
+#   smarthome  - enough to handle discovery events
+#   handlers   - enough to handle control and query events
+#   requests   - imported by the first call to OpenHAB
+# The time spent in each of this project's modules is reported alongside.
+# Exits with status 1 if a stage takes longer than its budget, in milliseconds.
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+stages = ('entrypoint', 'smarthome', 'handlers', 'requests')
+modules = ('tools', 'metrics', 'router', 'deadline', 'breaker', 'api', 'capabilities', 'items', 'catalog', 'cache',
+           'mirror', 'thermostat', 'coalesce', 'handlers', 'smarthome', 'entrypoint')
+budgets = {'entrypoint': 25.0, 'smarthome': 60.0, 'handlers': 60.0}
+
+
+# Imports a module in a fresh interpreter and returns the cumulative import time of every module, in ms.
+def import_times(module):
+    env = dict(os.environ)
+    # the handlers must not need a real OpenHAB installation just to be imported
+    for name in ('hostname', 'port', 'user', 'password'):
+        env.setdefault(name, 'benchmark')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=root, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000.0
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time per module and enforce a budget")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', action='append', default=[], metavar='STAGE=MS',
+                        help="maximum median import time for a stage, e.g. entrypoint=25")
+    args = parser.parse_args()
+    for budget in args.budget:
+        stage, ms = budget.split('=')
+        budgets[stage] = float(ms)
+
+    failed = False
+    for stage in stages:
+        runs = [import_times(stage) for _ in range(args.repeat)]
+        total = statistics.median(run[stage] for run in runs)
+        limit = budgets.get(stage)
+        verdict = "" if limit is None else " (budget %.1f ms)" % limit
+        if limit is not None and total > limit:
+            verdict += " OVER BUDGET"
+            failed = True
+        print("%-12s %8.1f ms%s" % (stage, total, verdict))
+        for module in modules:
+            if module != stage and all(module in run for run in runs):
+                print("  %-12s %8.1f ms" % (module, statistics.median(run[module] for run in runs)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
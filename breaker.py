@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+
+# Optional tuning for when OpenHAB can't be reached: after breaker_threshold calls in a row fail, further calls
+# fail straight away rather than each waiting for its own timeout. After breaker_cooldown seconds a single call is
+# let through to see whether OpenHAB is back. Set breaker_threshold to 0 to always make every call.
+breaker_threshold = int(os.environ.get('breaker_threshold', 5))
+breaker_cooldown = float(os.environ.get('breaker_cooldown', 30))
+
+
+# Raised instead of calling OpenHAB while the breaker is open.
+class CircuitOpen(Exception):
+    pass
+
+
+# Counts consecutive failed calls to a server, and stops calls being made for a while once there are too many.
+# closed - calls are made as normal
+# open - calls fail at once, until cooldown seconds have passed since the last failure
+# half-open - the next call (only one) is made as a probe, closing the breaker if it succeeds or opening it again
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        # when the breaker last opened, or None while it is closed
+        self.opened = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        return 'half-open' if self.probing or self.retry_in() == 0 else 'open'
+
+    # Returns the seconds until a probe may be made, which is 0 when the breaker isn't open.
+    def retry_in(self):
+        opened = self.opened
+        return 0 if opened is None else max(0.0, opened + self.cooldown - time.monotonic())
+
+    # Returns True if a call may be made, which must then be reported with succeeded() or failed().
+    def allow(self):
+        if self.opened is None:
+            return True
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.probing or time.monotonic() - self.opened < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def succeeded(self):
+        if self.failures or self.opened is not None:
+            with self.lock:
+                self.failures = 0
+                self.opened = None
+                self.probing = False
+
+    # Reports a call that was let through but says nothing about the server - e.g. one given too little time.
+    def abandoned(self):
+        if self.probing:
+            with self.lock:
+                # leave the next call to probe instead
+                self.probing = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing:
+                # still down - wait a while before probing again
+                self.probing = False
+                self.opened = time.monotonic()
+            elif self.opened is None and self.threshold and self.failures >= self.threshold:
+                self.opened = time.monotonic()
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+from api import DISCOVERY_FIELDS, streamItems
+from metrics import get_metrics
+from tools import from_json, to_json
+
+# Optional tuning for the discovery cache, in seconds.
+# Within discovery_ttl a cached device list is returned as-is. Up to discovery_max_stale it is
+# still returned immediately while a fresh copy is fetched in the background, and beyond that
+# discovery waits for OpenHAB. discovery_cache_file (e.g. /tmp/discovery.json) keeps the list across cold starts,
+# along with what each item was made into, so only the items that changed meanwhile are looked at again.
+discovery_ttl = float(os.environ.get('discovery_ttl', 60))
+discovery_max_stale = float(os.environ.get('discovery_max_stale', 3600))
+discovery_cache_file = os.environ.get('discovery_cache_file')
+
+
+# Holds the device list built from OpenHAB's items between invocations.
+# catalog is the Catalog (see catalog.py) that turns the item list into devices, and is only updated when the
+# items changed. backend names the OpenHAB instance the items are read from.
+class DiscoveryCache:
+    def __init__(self, catalog, ttl=60, max_stale=3600, path=None, backend=''):
+        self.catalog = catalog
+        self.backend = backend
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.path = path
+        self.devices = None
+        self.etag = None
+        self.digest = None
+        self.fetched = 0
+        self.lock = threading.Lock()
+        # held while a background refresh is running so only one is started at a time
+        self.pending = threading.Lock()
+        self.load()
+
+    # Returns the cached devices, refreshing them first or in the background as required.
+    # Returns None if there is nothing cached and OpenHAB can't be read.
+    def get(self):
+        age = time.time() - self.fetched
+        if self.devices is None or age > self.max_stale:
+            get_metrics().add('DiscoveryCacheMiss')
+            self.refresh()
+        else:
+            get_metrics().add('DiscoveryCacheHit')
+            if age > self.ttl:
+                self.refresh_in_background()
+        return self.devices
+
+    # Checks OpenHAB for changes and rebuilds the devices if there are any.
+    # Devices are built as the items stream in, rather than after the whole list has downloaded.
+    # Returns False if OpenHAB could not be read, leaving the cached devices alone.
+    def refresh(self):
+        with self.lock:
+            known = self.devices is not None
+            stream = streamItems(DISCOVERY_FIELDS, etag=self.etag if known else None, backend=self.backend)
+            if not stream:
+                return False
+            if not stream.not_modified:
+                try:
+                    with get_metrics().span('Build'):
+                        devices = self.catalog.update(stream)
+                except Exception as e:
+                    print("Error: " + str(e))
+                    return False
+                # there shouldn't be NO items - treat an empty list as a failure too.
+                if not stream.count:
+                    return False
+                # OpenHAB versions without etags send everything every time, so compare the content too.
+                # The digest is only known once the items have been read, by which time the catalog has been
+                # brought up to date - but as nothing changed, none of its items were made afresh.
+                if not known or stream.digest != self.digest:
+                    self.devices = devices
+                    self.digest = stream.digest
+                    self.save()
+                self.etag = stream.etag
+            self.fetched = time.time()
+            return True
+
+    def refresh_in_background(self):
+        if self.pending.acquire(blocking=False):
+            threading.Thread(target=self.background_refresh, daemon=True).start()
+
+    def background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self.pending.release()
+
+    # Restores a cache written by a previous container (or server), if there is one.
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                saved = from_json(f.read())
+            self.catalog.entries = saved['catalog']
+            self.devices = self.catalog.devices()
+            self.etag = saved['etag']
+            self.digest = saved['digest']
+            self.fetched = saved['fetched']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Writes the cache out atomically so a reader never sees a half-written file.
+    def save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path + ".tmp", 'w') as f:
+                # the device list is left out, as it is quickly put back together from the catalog
+                f.write(to_json({'catalog': self.catalog.entries, 'etag': self.etag, 'digest': self.digest,
+                                 'fetched': self.fetched}))
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            print("Could not save discovery cache: " + str(e))
@@ -0,0 +1,77 @@
+# "tags", in OpenHAB's nomenclature, define the capabilties of an item.
+# For instance, "Lighting", or "Switchable", which are bulbs and switches in OpenHAB's device list.
+# These tags translate into different actions to expose to the Echo - so we map them here, once,
+# rather than for every tag of every item that discovery looks at.
+
+# Switches and Lights have the same two features to an Echo - they can both be turned on and off.
+switchable = {
+    "Switch": [
+        "turnOn",
+        "turnOff"
+    ],
+    # Dimmers require the handling of percentage events as they are variable.
+    "Dimmer": [
+        "incrementPercentage",
+        "decrementPercentage",
+        "setPercentage",
+        "turnOn",
+        "turnOff"
+    ],
+    # Color devices (usually RGB bulbs) require percentages, switching capabilitiy,
+    # and the ability to set Colour
+    "Color": [
+        "incrementPercentage",
+        "decrementPercentage",
+        "setPercentage",
+        "turnOn",
+        "turnOff",
+        "setColor"
+    ],
+    # Rollershutters are percentage devices only.
+    "Rollershutter": [
+        "setPercentage",
+        "incrementPercentage",
+        "decrementPercentage"
+    ]
+}
+
+# Maps (tag, item type) to the actions available. A type of None matches any item type.
+capabilities = {(tag, kind): actions for tag in ('Lighting', 'Switchable') for kind, actions in switchable.items()}
+# A group of items of the same type gets the actions of that type.
+group_capabilities = dict(capabilities)
+# Temperature sensors can also exist outside
+# of a thermostat group. This allows them to work as individual devices
+# too.
+capabilities[('CurrentTemperature', None)] = [
+    "getTemperatureReading"
+]
+# actions available for a thermostat group - a
+# collection of items that function together as a thermostat.
+capabilities[('Thermostat', 'Group')] = [
+    "incrementTargetTemperature",
+    "decrementTargetTemperature",
+    "setTargetTemperature",
+    "getTargetTemperature",
+    "getTemperatureReading"
+]
+
+# Tags whose devices report a temperature, and so need a temperature format.
+temperature_tags = frozenset(('Thermostat', 'CurrentTemperature'))
+fahrenheit_tags = frozenset(('Fahrenheit', 'fahrenheit'))
+
+
+# Returns the actions an Item (see items.py) exposes for one of its tags, or None if it has none.
+def actions_for(tag, item):
+    kind = item.type
+    actions = capabilities.get((tag, kind))
+    # Set actions for a group
+    if actions is None and kind == 'Group' and item.group_type:
+        actions = group_capabilities.get((tag, item.group_type))
+    if actions is None:
+        actions = capabilities.get((tag, None))
+    return actions
+
+
+# Returns the temperature format for a device that reports temperatures.
+def temperature_format(tags):
+    return "celsius" if fahrenheit_tags.isdisjoint(tags) else "fahrenheit"
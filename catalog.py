@@ -0,0 +1,38 @@
+from metrics import get_metrics
+
+
+# Returns what discovery sees of an item, other than its name, as a single string to compare with the last one.
+# This is cheaper than hashing it, and no longer.
+def fingerprint(item):
+    return '\x1e'.join((item.get('label') or '', item['type'], item.get('groupType') or '',
+                        '\x1f'.join(item.get('tags', ())), '\x1f'.join(item.get('groupNames', ()))))
+
+
+# What discovery made of each item, by item name, as (fingerprint, entry) - so that when the items change only
+# those that did are looked at again. build(item) makes an item's entry, and assemble(entries) turns the entries
+# of every item, in OpenHAB's order, into the device list.
+class Catalog:
+    def __init__(self, build, assemble):
+        self.build = build
+        self.assemble = assemble
+        self.entries = {}
+
+    # Brings the catalog up to date with the items OpenHAB has now, returning the device list.
+    # The catalog is left as it was if reading the items fails.
+    def update(self, items):
+        entries = {}
+        known = self.entries
+        rebuilt = 0
+        for item in items:
+            digest = fingerprint(item)
+            entry = known.get(item['name'])
+            if entry is None or entry[0] != digest:
+                entry = (digest, self.build(item))
+                rebuilt += 1
+            entries[item['name']] = entry
+        self.entries = entries
+        get_metrics().add('DiscoveryRebuilt', rebuilt)
+        return self.devices()
+
+    def devices(self):
+        return self.assemble([entry for _, entry in self.entries.values()])
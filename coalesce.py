@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+from api import current_backend
+
+# Optional: milliseconds to hold an increment or decrement, so that others for the same item arriving meanwhile
+# (e.g. "turn it up" said several times, or a routine) are sent to OpenHAB as one command. Off by default, when
+# only changes arriving while the last one to the item is still being made are merged.
+# Only directives handled by the same process at the same time are merged - see batch_handler and server.py.
+write_coalesce_ms = float(os.environ.get('write_coalesce_ms', 0))
+
+
+# Changes for one item, collected while the first of them waits out the window.
+class Batch:
+    def __init__(self):
+        self.deltas = []
+        self.done = threading.Event()
+        # what apply returned - this error unless it returned at all
+        self.result = "OpenHAB error"
+
+
+# Merges changes to the same item of the same OpenHAB instance that arrive within window seconds of each other,
+# or while the last change to it is being made. apply(name, deltas) makes the merged change, and its result is
+# returned to every directive that joined in.
+# Changes to an item are made one batch after another, as each reads the item's state and adds to it - two at once
+# would both add to the same state, losing one of them.
+class DeltaCoalescer:
+    def __init__(self, window, apply):
+        self.window = window
+        self.apply = apply
+        # batches still taking changes, and those being made, by (instance, item name)
+        self.pending = {}
+        self.running = {}
+        self.lock = threading.Lock()
+
+    # Adds a change for an item, returning once it has been made along with any others that joined it.
+    def submit(self, name, delta):
+        key = (current_backend.get(), name)
+        with self.lock:
+            batch = self.pending.get(key)
+            leading = batch is None
+            if leading:
+                batch = self.pending[key] = Batch()
+                previous = self.running.get(key)
+            batch.deltas.append(delta)
+        if not leading:
+            batch.done.wait()
+            return batch.result
+        if previous is not None:
+            previous.done.wait()
+        if self.window:
+            time.sleep(self.window)
+        with self.lock:
+            # anything arriving from now on starts a new batch, made after this one
+            del self.pending[key]
+            self.running[key] = batch
+        try:
+            batch.result = self.apply(name, batch.deltas)
+        finally:
+            with self.lock:
+                del self.running[key]
+            batch.done.set()
+        return batch.result
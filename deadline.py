@@ -0,0 +1,93 @@
+import contextlib
+import contextvars
+import os
+import time
+
+# Optional: milliseconds of an invocation's time kept back for answering Alexa, so that when OpenHAB is slow
+# an error goes back before AWS stops the function (default 250).
+deadline_reserve_ms = float(os.environ.get('deadline_reserve_ms', 250))
+
+
+# Raised instead of calling OpenHAB when the invocation has no time left to wait for an answer.
+class DeadlineExceeded(Exception):
+    pass
+
+
+# When the invocation being handled by this thread or task must have answered by, on the time.monotonic() clock.
+# None when there's no limit other than the timeout setting, e.g. in server mode.
+current = contextvars.ContextVar('deadline', default=None)
+# How many calls to OpenHAB, one after another, the directive being handled still expects to make - as a list,
+# so that calls made from other threads (e.g. hedged reads) count too. None when not known.
+planned = contextvars.ContextVar('planned', default=None)
+
+
+# Returns the seconds left before the deadline, or None if there isn't one.
+def remaining():
+    deadline = current.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# Tells the calls to OpenHAB that follow how many of them there will be, one after another, so that each only
+# takes its share of the time left - e.g. 2 for reading an item then sending it a command.
+def plan(calls):
+    planned.set([calls])
+
+
+# Returns how long a call to OpenHAB may take: seconds, or the call's share of what is left before the deadline
+# if that's less. Raises DeadlineExceeded if nothing is left.
+def budget(seconds):
+    left = remaining()
+    if left is None:
+        return seconds
+    if left <= 0:
+        raise DeadlineExceeded("No time left to call OpenHAB")
+    calls = planned.get()
+    if calls:
+        share = left / max(calls[0], 1)
+        calls[0] -= 1
+        return min(seconds, share)
+    return min(seconds, left)
+
+
+# Returns a copy of the current context for calls to OpenHAB made at the same time, e.g. by fanOut. Between them
+# they count as a single planned call, so each may take that call's share of the time left - and no more, leaving
+# the calls planned after them theirs.
+def together():
+    context = contextvars.copy_context()
+    calls = planned.get()
+    left = remaining()
+    if calls and left is not None:
+        share = max(left, 0) / max(calls[0], 1)
+        calls[0] -= 1
+        context.run(start_round, time.monotonic() + share)
+    return context
+
+
+def start_round(deadline):
+    current.set(deadline)
+    planned.set(None)
+
+
+# Raises DeadlineExceeded if the deadline has passed.
+def check():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Out of time")
+
+
+# Limits the calls to OpenHAB made in the block to the time AWS gives the invocation, less deadline_reserve_ms.
+# context is the Lambda context object, and without one (or outside of AWS) nothing is limited.
+@contextlib.contextmanager
+def within(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        yield
+        return
+    seconds = (context.get_remaining_time_in_millis() - deadline_reserve_ms) / 1000
+    token = current.set(time.monotonic() + seconds)
+    # a plan is only for the invocation that made it
+    plan_token = planned.set(None)
+    try:
+        yield
+    finally:
+        planned.reset(plan_token)
+        current.reset(token)
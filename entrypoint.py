@@ -1,5 +1,17 @@
-from smarthome import handle_control, handle_discovery
-from tools import generate_response
+import os
+
+from api import asynchronous, backends, current_backend, health, locate, pool_size
+from deadline import remaining, within
+from metrics import invocation
+from router import lookup, register
+from tools import generate_error, generate_response
+
+# Only what the health check needs is imported up front. The discovery and control handlers
+# (and the HTTP client beneath them) are imported by the router for the first event that needs them,
+# which keeps them out of the cold start of every other event.
+
+# The most directives of a batch that may be waiting on OpenHAB at once.
+batch_concurrency = int(os.environ.get('batch_concurrency', pool_size))
 
 
 # This is the primary entrypoint for the function when invoked by AWS.
@@ -7,27 +19,59 @@ from tools import generate_response
 # The primary payload is received here - serialized JSON data that will describe
 # an action for a relevant device, or will be a system command such as a request to enumerate devices
 # or check the health of the system and that it is responding.
+# Every call to OpenHAB is limited to the time the invocation has left (see deadline.py), so when OpenHAB is
+# slow Alexa is sent an error rather than nothing at all.
+
+def lambda_handler(event, context):
+    with invocation(event) as metrics, within(context):
+        try:
+            response = dispatch(event, metrics)
+        except Exception:
+            metrics.add('Errors')
+            raise
+        if response['header']['name'].endswith('Error'):
+            metrics.add('Errors')
+        return response
+
+
+def dispatch(event, metrics):
+    # The namespace and name describe the type of command received - see router.py for where each goes.
+    header = event['header']
+    left = remaining()
+    if left is not None and left <= 0:
+        # e.g. a directive that waited its turn in a batch for too long
+        metrics.add('DeadlineExceeded')
+        return generate_error(event)
+    handler = lookup(header['namespace'], header['name'])
+    metrics.mark('Dispatch')
+    if not handler:
+        return unexpected(event)
+    appliance = event.get('payload', {}).get('appliance')
+    if appliance is None or not backends[0]:
+        return handler(event)
+    # With several OpenHAB instances, the applianceId names the one the device belongs to - see api.py.
+    # The handler sees the item's own name, and its calls go to that instance.
+    backend, name = locate(appliance['applianceId'])
+    token = current_backend.set(backend)
+    try:
+        return handler(dict(event, payload=dict(event['payload'], appliance=dict(appliance, applianceId=name))))
+    finally:
+        current_backend.reset(token)
+
+
+# System health check - not a user command
+# Reports whether OpenHAB is reachable, judging by the circuit breaker rather than calling it - see breaker.py.
+def health_check(event):
+    healthy, description = health()
+    return {
+        "header": generate_response(event, "Response"), "payload": {
+            "description": description,
+            "isHealthy": healthy}
+    }
+
 
-def lambda_handler(event, _):
-    # The namespace is the primary driver of events. It describes the type of command received.
-    namespace = event['header']['namespace']
-    # Discover event. Dispatch handler to enumerate devices
-    if namespace == 'Alexa.ConnectedHome.Discovery':
-        return handle_discovery(event)
-
-    # Control event - dispatch handler to perform requested action.
-    elif namespace in ('Alexa.ConnectedHome.Control', 'Alexa.ConnectedHome.Query'):
-        return handle_control(event)
-
-    # System health check - not a user command
-    elif namespace == 'Alexa.ConnectedHome.System' and event['header']['name'] == "HealthCheckRequest":
-        return {
-            "header": generate_response(event, "Response"), "payload": {
-                "description": "The system is currently healthy",
-                "isHealthy": True}
-        }
-
-    # Return error for unknown request, along with offending payload
+# Return error for unknown request, along with offending payload
+def unexpected(event):
     return {
         'header': {
             "namespace": "Alexa.ConnectedHome.Control",
@@ -37,3 +81,41 @@ def lambda_handler(event, _):
         },
         'payload': {"faultingParameter": event['header']['namespace']}
     }
+
+
+register('Alexa.ConnectedHome.System', 'HealthCheckRequest', health_check)
+lambda_handler_async = asynchronous(lambda_handler)
+
+
+# Entrypoint for handling several directives in one invocation, such as a routine switching on a whole room.
+# The event is either a list of directives or {"directives": [...]}. The OpenHAB calls of up to
+# batch_concurrency directives run at the same time, and responses come back in the order of the directives.
+def batch_handler(event, context):
+    import asyncio
+    directives = event if isinstance(event, list) else event['directives']
+    return asyncio.run(handle_batch(directives, batch_concurrency, context))
+
+
+# context is the invocation's Lambda context, and every directive shares its deadline.
+async def handle_batch(directives, concurrency, context=None):
+    import asyncio
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(event):
+        async with semaphore:
+            return await lambda_handler_async(event, context)
+
+    # One bad directive shouldn't lose the responses for the rest.
+    responses = await asyncio.gather(*(handle(event) for event in directives), return_exceptions=True)
+    for position, response in enumerate(responses):
+        if isinstance(response, Exception):
+            print("Error: " + str(response))
+            responses[position] = batch_error(directives[position])
+    return responses
+
+
+# An error for a directive of a batch that couldn't be handled - which may be so malformed it has no header.
+def batch_error(event):
+    header = event.get('header') if isinstance(event, dict) else None
+    message_id = header.get('messageId', '') if isinstance(header, dict) else ''
+    return generate_error({'header': {'messageId': message_id}})
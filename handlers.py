@@ -1,21 +1,32 @@
 import datetime
-from api import *
-from tools import *
+import os
+
+from api import asynchronous, fanOut, postCommand
+from coalesce import DeltaCoalescer, write_coalesce_ms
+from deadline import plan
+from mirror import readItem
+from thermostat import readThermostat
+from tools import convert_to_c, convert_to_f, generate_error, generate_response, is_fahrenheit, thermo_to_string
+
+# Optional: set group_fanout to 1 to have percentage increments and decrements of a Dimmer, Color or Rollershutter
+# group change each of its members by the same amount, keeping the differences between them, rather than setting
+# them all to the group's state plus the change. The members are sent their commands at the same time.
+group_fanout = os.environ.get('group_fanout', '').lower() in ('1', 'true', 'yes')
+
+# Item types that take a percentage.
+percentage_types = ('Dimmer', 'Color', 'Rollershutter')
 
 
 # Function for getting a current actual temperature from a thermostat item or thermostat group.
 # As thermostat groups are item groups, we are attempting to locate and parse the
 # Actual temperature reading.
 def current_temperature(event):
-    item = getItem(event['payload']['appliance']['applianceId'])
-    if not item:
+    # Only the temperature member's state is read once the group's members are known - see thermostat.py
+    thermostat = readThermostat(event['payload']['appliance']['applianceId'], 'currentTemperature')
+    if not (thermostat and 'currentTemperature' in thermostat[1]):
         return generate_error(event, "No current temperature data found")
-    # if a group is detected, build a thermostat item out of them
-    if item['type'] == "Group":
-        items = generate_thermostat(item['members'])
-        item = items['currentTemperature']
     try:
-        number = float(item['state'])
+        number = float(thermostat[1]['currentTemperature'])
     except ValueError:
         return generate_error(event, "Temperature data invalid")  # String cannot be parsed
     return {
@@ -41,44 +52,93 @@ def percentage_request(event):
     # A "PercentageRequest" requires the existing percentage to be read
     # And then modified in some way.
     elif 'PercentageRequest' in event['header']['name']:
-        # gets the percentage value item such that we may read its current state
-        item = getItem(name)
         # parse the delta percentage requested into a float
         value = float(event['payload']['deltaPercentage']['value'])
-        if not item:
-            # Item not found - device has probably been removed
-            return generate_error(event)
-        try:
-            number = float(item['state'])
-        except ValueError:
-            return generate_error(event, "No existing percentage")
-        # Set values for increment and decrement
-        values = {
-            'IncrementPercentageRequest': number + value,
-            'DecrementPercentageRequest': number - value
-        }
-        # Set which we are actually doing
-        value = values[event['header']['name']]
-        value = 100 if value > 100 else 0 if value < 0 else value  # Prevents wrap-around
+        delta = value if event['header']['name'] == 'IncrementPercentageRequest' else -value
+        # the item is read, then sent its new percentage
+        plan(2)
+        # Changes to the same item are made one after another, and may be merged with others arriving at the same
+        # time - see coalesce.py
+        error = percentage_writes.submit(name, delta)
         return {
             'header': generate_response(event, "Confirmation"),
             'payload': {}
-        } if postCommand(name, str(
-            value)) else generate_error(event)
+        } if error is None else generate_error(event, error)
+
+
+# Applies one or more percentage changes to an item, as a single command - or one for each member, for a group
+# when group_fanout is set. Returns None on success, or the reason it failed.
+def adjust_percentage(name, deltas):
+    # gets the percentage value item such that we may read its current state - from the
+    # state mirror if it is running, see mirror.py
+    item = readItem(name)
+    if not item:
+        # Item not found - device has probably been removed
+        return "OpenHAB error"
+    # A group is read along with the states of its members, so they can be changed one by one straight away
+    if group_fanout and item['type'] == 'Group' and item.get('groupType') in percentage_types and item.get('members'):
+        return adjust_members(item['members'], deltas)
+    try:
+        value = float(item['state'])
+    except ValueError:
+        return "No existing percentage"
+    # Apply each change in turn, as if they had been sent separately
+    for delta in deltas:
+        value += delta
+        value = 100 if value > 100 else 0 if value < 0 else value  # Prevents wrap-around
+    return None if postCommand(name, str(value)) else "OpenHAB error"
+
+
+# Applies percentage changes to each member of a group that takes a percentage, by sending each its own command.
+# Returns None on success, or the reason it failed.
+def adjust_members(members, deltas):
+    commands = []
+    found = False
+    for member in members:
+        if member['type'] not in percentage_types and member.get('groupType') not in percentage_types:
+            continue
+        value = percentage_of(member['state'])
+        if value is None:
+            continue
+        found = True
+        current = value
+        for delta in deltas:
+            value += delta
+            value = 100 if value > 100 else 0 if value < 0 else value  # Prevents wrap-around
+        # members already as far as they go are left alone
+        if value != current:
+            commands.append((member['name'], str(value)))
+    if not found:
+        return "No existing percentage"
+    # at most pool_size commands are on their way at once - see fanOut
+    return None if all(fanOut(postCommand, commands)) else "OpenHAB error"
+
+
+# Returns the percentage an item's state describes, or None if it doesn't - e.g. "NULL".
+# A colour's percentage is its brightness.
+def percentage_of(state):
+    try:
+        return float(state.rpartition(',')[2])
+    except ValueError:
+        return None
+
+
+percentage_writes = DeltaCoalescer(write_coalesce_ms / 1000.0, adjust_percentage)
 
 
 # Gets target temperature for a thermostat.
 # This locates and parses the value of OpenHAB's "setpoint" item in the thermostat group..
 def target_temperature(event):
-    item = getItem(event['payload']['appliance']['applianceId'])
-    # Item must both exist and be a "Group", as a setpoint can't exist on its own.
-    if not (item and item['type'] == "Group"):
-        return generate_error(event, "No target temperature data found")
     # A thermostat in OpenHAB consists of several items - temp monitor, setpoint etc
-    items = generate_thermostat(item['members'])
+    thermostat = readThermostat(event['payload']['appliance']['applianceId'], 'targetTemperature',
+                                'heatingCoolingMode')
+    # The setpoint must exist, and can only do so as part of a "Group".
+    if not (thermostat and 'targetTemperature' in thermostat[1]):
+        return generate_error(event, "No target temperature data found")
+    states = thermostat[1]
     try:
         # Get current target temperature
-        number = float(items['targetTemperature']['state'])
+        number = float(states['targetTemperature'])
     except ValueError:
         return generate_error(event, "Temperature data invalid")
     # Generate response payload containing new target Temperature
@@ -93,7 +153,7 @@ def target_temperature(event):
             "temperatureMode": {
                 # Read heating and cooling mode - if not set, just reply "CUSTOM"
                 "value": thermo_to_string(
-                    items['heatingCoolingMode']['state']) if 'heatingCoolingMode' in items else "CUSTOM"
+                    states['heatingCoolingMode']) if 'heatingCoolingMode' in states else "CUSTOM"
             }
         }
     }
@@ -125,38 +185,40 @@ def colour_request(event):
 # Can either be an absolute temperature, or a delta temperature
 # of the existing setpoint
 def temperature_request(event):
-    # Get thermostat group
-    item = getItem(event['payload']['appliance']['applianceId'])
+    # the thermostat is read, then sent its new setpoint
+    plan(2)
+    # Get the thermostat group's setpoint and mode
+    thermostat = readThermostat(event['payload']['appliance']['applianceId'], 'targetTemperature',
+                                'heatingCoolingMode')
 
     # A setpoint cannot exist independently, so the item must be a group
-    if not (item and item['type'] == "Group"):
+    if not thermostat:
         return generate_error(event, "No thermostat found")
-
-    # Create composite thermostat device
-    items = generate_thermostat(item['members'])
+    roles, states = thermostat
 
     # A delta cannot be requested if there is no existing temperature.
-    if 'targetTemperature' not in items:
+    if 'targetTemperature' not in states:
         return generate_error(event, "No target temperature")
 
-    # Parse current temperature to integer
+    # Parse current temperature
     try:
-        value = int(items['targetTemperature']['state'])
+        value = float(states['targetTemperature'])
     except ValueError:
         return generate_error(event, "Temperature data invalid")
     fahren = is_fahrenheit(event)
 
     # Determines correct values for 3 scenarios - absolute temperature, delta reduction, delta increase
-    values = {
-        "SetTargetTemperatureRequest": convert_to_f(event['payload']['targetTemperature']['value']) if fahren else
-        event['payload']['targetTemperature']['value'],
-        "IncrementTargetTemperatureRequest": value + event['payload']['deltaTemperature']['value'],
-        "DecrementTargetTemperatureRequest": value - event['payload']['deltaTemperature']['value']
-    }
-    setval = values[event['header']['name']]
+    name = event['header']['name']
+    if name == "SetTargetTemperatureRequest":
+        setval = event['payload']['targetTemperature']['value']
+        setval = convert_to_f(setval) if fahren else setval
+    elif name == "IncrementTargetTemperatureRequest":
+        setval = value + event['payload']['deltaTemperature']['value']
+    else:
+        setval = value - event['payload']['deltaTemperature']['value']
 
     # Set a heat/cool mode if there's an item for it, else just set AUTO
-    mode = thermo_to_string(items['heatingCoolingMode']['state']) if 'heatingCoolingMode' in items else "AUTO"
+    mode = thermo_to_string(states['heatingCoolingMode']) if 'heatingCoolingMode' in states else "AUTO"
 
     return {
         'header': generate_response(event, "Confirmation"),
@@ -176,7 +238,7 @@ def temperature_request(event):
                 }
             }
         }
-    } if postCommand(items['targetTemperature'], str(setval)) else generate_error(event)
+    } if postCommand(roles['targetTemperature'], str(setval)) else generate_error(event)
 
 
 # Handles basic switch events - on/off etc
@@ -187,3 +249,12 @@ def switch_request(event):
     } if postCommand(
         event['payload']['appliance']['applianceId'],
         "ON" if 'On' in event['header']['name'] else "OFF") else generate_error(event)
+
+
+# asyncio variants of the request functions above, for handling several directives concurrently.
+current_temperature_async = asynchronous(current_temperature)
+percentage_request_async = asynchronous(percentage_request)
+target_temperature_async = asynchronous(target_temperature)
+colour_request_async = asynchronous(colour_request)
+temperature_request_async = asynchronous(temperature_request)
+switch_request_async = asynchronous(switch_request)
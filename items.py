@@ -0,0 +1,62 @@
+import sys
+
+from capabilities import capabilities, fahrenheit_tags, temperature_tags
+
+# OpenHAB's items, as JSON, repeat the same keys, types and tags thousands of times over. Kept as records instead,
+# each item's type, tags and group names are shared with every other item's, the tags that this project understands
+# can be checked for in a single int, and there's no dict per item - which is several times smaller once there are
+# thousands of them.
+
+# The tags that mean something here, each given a bit of an item's tag_bits, so they can be looked for quickly.
+vocabulary = tuple(sorted({tag for tag, _ in capabilities} | temperature_tags | fahrenheit_tags |
+                          {'TargetTemperature', 'homekit:HeatingCoolingMode'}))
+bits = {tag: 1 << position for position, tag in enumerate(vocabulary)}
+
+# Shared tuples, by their contents, so items in the same groups (or with the same tags) share one.
+shared = {(): ()}
+
+
+# Returns a tuple of interned strings equal to the ones given, shared with any other item that has the same.
+def share(strings):
+    strings = tuple(strings)
+    found = shared.get(strings)
+    if found is None:
+        found = shared[strings] = tuple(sys.intern(string) for string in strings)
+    return found
+
+
+# An OpenHAB item, holding the fields of DISCOVERY_FIELDS and its state.
+class Item:
+    __slots__ = ('name', 'label', 'type', 'group_type', 'tags', 'tag_bits', 'group_names', 'state')
+
+    def __init__(self, name, label, type, group_type=None, tags=(), group_names=(), state=None):
+        self.name = name
+        self.label = label
+        self.type = sys.intern(type)
+        self.group_type = sys.intern(group_type) if group_type else None
+        # in OpenHAB's order, as the devices of an item are listed in the order of its tags
+        self.tags = share(tags)
+        mask = 0
+        for tag in self.tags:
+            mask |= bits.get(tag, 0)
+        self.tag_bits = mask
+        self.group_names = share(group_names)
+        self.state = state
+
+    def has(self, tag):
+        bit = bits.get(tag)
+        return bool(self.tag_bits & bit) if bit else tag in self.tags
+
+    # Returns the item as OpenHAB sends it, for code that works with its JSON.
+    def to_dict(self):
+        item = {'name': self.name, 'label': self.label, 'type': self.type, 'tags': list(self.tags),
+                'groupNames': list(self.group_names), 'state': self.state}
+        if self.group_type:
+            item['groupType'] = self.group_type
+        return item
+
+
+# Makes an Item from an item as OpenHAB sends it.
+def compact(item, state=None):
+    return Item(item['name'], item.get('label') or '', item['type'], item.get('groupType'), item.get('tags', ()),
+                item.get('groupNames', ()), item.get('state', state))
@@ -0,0 +1,123 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from tools import to_json
+
+# Optional: set metrics to 1 to log one line per invocation with where its time went, in CloudWatch's
+# embedded metric format - CloudWatch turns these lines into metrics without any extra calls.
+# When off, every measurement below is a call to a method that does nothing.
+metrics = os.environ.get('metrics', '').lower() in ('1', 'true', 'yes')
+metrics_namespace = os.environ.get('metrics_namespace', 'OpenHABEcho')
+
+# Timings, in milliseconds:
+#   Duration - the whole invocation
+#   Dispatch - from the start of the invocation until its handler is called, e.g. importing the handlers
+#   OpenHAB  - waiting on OpenHAB's responses, summed over every call
+#   Parse    - decoding OpenHAB's JSON
+#   Build    - building the discovery device list, including reading the items as they stream in
+timings = ('Duration', 'Dispatch', 'OpenHAB', 'Parse', 'Build')
+# Counts, e.g. HttpCalls, HttpErrors, Errors, DiscoveryCacheHit, StateMirrorMiss.
+# DiscoveryRebuilt is the number of items whose devices were made afresh, rather than taken from the catalog.
+counts = ('HttpCalls', 'HttpErrors', 'Errors', 'DiscoveryCacheHit', 'DiscoveryCacheMiss', 'DiscoveryRebuilt',
+          'StateMirrorHit', 'StateMirrorMiss', 'HedgedCalls', 'DeadlineExceeded', 'CircuitOpen')
+
+
+# Measurements for a single invocation.
+class Metrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.values = {}
+        self.calls = []
+        # an invocation may call OpenHAB from several threads at once
+        self.lock = threading.Lock()
+
+    # Adds milliseconds (or a count) to a metric.
+    def add(self, name, value=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    # Records how long it has been since the invocation started.
+    def mark(self, name):
+        self.values[name] = (time.perf_counter() - self.start) * 1000
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    # Records a call to OpenHAB. status is 0 if no response was received.
+    def http(self, method, item, status, size, seconds):
+        self.add('OpenHAB', seconds * 1000)
+        self.add('HttpCalls')
+        if status not in (200, 201, 304):
+            self.add('HttpErrors')
+        self.calls.append({'method': method, 'item': item, 'status': status, 'bytes': size,
+                           'ms': round(seconds * 1000, 3)})
+
+    # Writes the invocation's metrics to the log as a single line.
+    def emit(self, directive):
+        self.mark('Duration')
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': metrics_namespace,
+                    'Dimensions': [['Directive']],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in timings] +
+                               [{'Name': name, 'Unit': 'Count'} for name in counts]
+                }]
+            },
+            'Directive': directive,
+            'HttpRequests': self.calls
+        }
+        for name in timings + counts:
+            record[name] = round(self.values.get(name, 0), 3)
+        print(to_json(record))
+
+
+# Stands in for Metrics when they are off.
+class NoMetrics:
+    def add(self, name, value=1):
+        pass
+
+    def mark(self, name):
+        pass
+
+    def span(self, name):
+        return no_span
+
+    def http(self, method, item, status, size, seconds):
+        pass
+
+
+no_span = contextlib.nullcontext()
+no_metrics = NoMetrics()
+# The invocation being handled by this thread or task.
+current = contextvars.ContextVar('metrics', default=no_metrics)
+
+
+# Returns the metrics for the invocation in progress.
+def get_metrics():
+    return current.get()
+
+
+# Measures an invocation, emitting its metrics when the block finishes.
+# Yields the invocation's Metrics, or NoMetrics when they are off.
+@contextlib.contextmanager
+def invocation(event):
+    if not metrics:
+        yield no_metrics
+        return
+    measured = Metrics()
+    token = current.set(measured)
+    try:
+        yield measured
+    finally:
+        current.reset(token)
+        measured.emit(event.get('header', {}).get('name', 'Unknown'))
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+
+from api import DISCOVERY_FIELDS, backends, current_backend, get_client, getItem, getStates, streamItems
+from items import compact
+from metrics import get_metrics
+
+# Optional: set state_mirror to 1 to keep a copy of every item's state, updated from OpenHAB's event stream,
+# so handlers can skip reading an item before acting on it. The copy is only trusted while events
+# (or a fresh copy of the items) have arrived within the last state_mirror_max_age seconds.
+state_mirror = os.environ.get('state_mirror', '').lower() in ('1', 'true', 'yes')
+state_mirror_max_age = float(os.environ.get('state_mirror_max_age', 60))
+
+# Item events as named by OpenHAB 2 ("smarthome") and 3 onwards ("openhab").
+topics = ('smarthome/items/*', 'openhab/items/*')
+# The last part of a topic, for events that carry a new state.
+state_events = ('state', 'statechanged', 'stateupdated')
+
+
+# An in-memory copy of an OpenHAB instance's items and their states, kept as Items (see items.py).
+# A background thread subscribes to /rest/events, then loads every item, then applies each event in turn.
+# If the stream goes quiet for max_age seconds it reconnects and loads everything again, as events
+# may have been missed - e.g. while AWS had the container frozen between invocations.
+class StateMirror:
+    def __init__(self, backend, max_age=60):
+        self.backend = backend
+        self.client = get_client(backend)
+        self.max_age = max_age
+        self.items = {}
+        # group name -> names of its members
+        self.members = {}
+        self.lock = threading.Lock()
+        self.connected = False
+        self.last_seen = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def fresh(self):
+        return self.connected and time.time() - self.last_seen < self.max_age
+
+    # Returns an item as getItem would, including the members of a group,
+    # or None if it isn't known or the mirror can't be trusted right now.
+    def item(self, name):
+        if not self.fresh():
+            return None
+        with self.lock:
+            if name not in self.items:
+                return None
+            item = self.items[name].to_dict()
+            if item['type'] == 'Group':
+                item['members'] = [self.items[member].to_dict() for member in self.members.get(name, ())
+                                   if member in self.items]
+        return item
+
+    # Returns an item's state, or None if it isn't known or the mirror can't be trusted right now.
+    def state(self, name):
+        if not self.fresh():
+            return None
+        item = self.items.get(name)
+        return item.state if item else None
+
+    def run(self):
+        while True:
+            try:
+                resp = self.client.events(topics, idle=self.max_age)
+                try:
+                    # Subscribe before loading the items, so nothing that changes in between is missed.
+                    self.load()
+                    self.connected = True
+                    for line in resp.iter_lines(decode_unicode=True):
+                        self.last_seen = time.time()
+                        if line and line.startswith('data:'):
+                            self.apply(json.loads(line[5:]))
+                finally:
+                    self.connected = False
+                    resp.close()
+            except Exception as e:
+                print("State mirror disconnected: " + str(e))
+            time.sleep(1)
+
+    # Replaces the copy with every item OpenHAB has now.
+    def load(self):
+        stream = streamItems(DISCOVERY_FIELDS + ('state',), backend=self.backend)
+        if not stream:
+            raise IOError("Could not load items")
+        items = {}
+        members = {}
+        for item in map(compact, stream):
+            items[item.name] = item
+            for group in item.group_names:
+                members.setdefault(group, set()).add(item.name)
+        with self.lock:
+            self.items = items
+            self.members = members
+        self.last_seen = time.time()
+
+    # Applies a single event, e.g. {"topic": "openhab/items/Light/statechanged", "payload": "{...}"}
+    # Group events name the group, then the member that caused the change.
+    def apply(self, event):
+        parts = event.get('topic', '').split('/')
+        if len(parts) < 4 or parts[1] != 'items':
+            return
+        name, kind = parts[2], parts[-1]
+        payload = json.loads(event['payload']) if event.get('payload') else None
+        with self.lock:
+            if kind in state_events:
+                if name in self.items:
+                    self.items[name].state = payload['value']
+            elif kind == 'added':
+                self.add(payload)
+            elif kind == 'updated':
+                # the payload holds the item as it now is, followed by how it was.
+                # Keep the last known state, as the definition doesn't carry one.
+                old = self.items.get(payload[1]['name'])
+                self.remove(payload[1]['name'])
+                self.add(payload[0], old.state if old else None)
+            elif kind == 'removed':
+                self.remove(name)
+
+    def add(self, item, state=None):
+        item = compact(item, state or 'NULL')
+        self.items[item.name] = item
+        for group in item.group_names:
+            self.members.setdefault(group, set()).add(item.name)
+
+    def remove(self, name):
+        item = self.items.pop(name, None)
+        if item:
+            for group in item.group_names:
+                self.members.get(group, set()).discard(name)
+
+
+# One for each OpenHAB instance, by name.
+mirrors = {}
+if state_mirror:
+    for backend in backends:
+        mirrors[backend] = StateMirror(backend, state_mirror_max_age)
+        mirrors[backend].start()
+
+
+# Reads an item from the state mirror when it is running and up to date, and from OpenHAB otherwise.
+def readItem(name):
+    mirror = mirrors.get(current_backend.get())
+    if not mirror:
+        return getItem(name)
+    item = mirror.item(name)
+    get_metrics().add('StateMirrorHit' if item else 'StateMirrorMiss')
+    return item or getItem(name)
+
+
+# Reads the states of several items, as a list in the same order as the names. States come from
+# the state mirror when it is running and up to date, and the rest are read from OpenHAB at the same time.
+def readStates(names):
+    mirror = mirrors.get(current_backend.get())
+    states = [mirror.state(name) for name in names] if mirror else [None] * len(names)
+    missing = [name for name, state in zip(names, states) if state is None]
+    if mirror:
+        get_metrics().add('StateMirrorHit', len(names) - len(missing))
+        get_metrics().add('StateMirrorMiss', len(missing))
+    if missing:
+        read = dict(zip(missing, getStates(missing)))
+        states = [read[name] if state is None else state for name, state in zip(names, states)]
+    return states
@@ -0,0 +1,55 @@
+from importlib import import_module
+
+# Maps each directive, as (namespace, name), to the function that handles it.
+# Functions may be given as "module.function" so that their module is only imported by the first directive
+# that needs it - a health check never imports the discovery and control handlers, for instance.
+routes = {}
+# Handles any directive in a namespace that has no route of its own.
+fallbacks = {}
+
+
+# Adds a handler for a directive, replacing any existing one.
+def register(namespace, name, handler):
+    routes[(namespace, name)] = handler
+
+
+# Adds a handler for every directive in a namespace that has no route of its own.
+def register_fallback(namespace, handler):
+    fallbacks[namespace] = handler
+
+
+# Returns the function that handles a directive, or None if nothing does.
+def lookup(namespace, name):
+    key = (namespace, name)
+    handler = routes.get(key)
+    if handler is None:
+        key = namespace
+        handler = fallbacks.get(namespace)
+    if isinstance(handler, str):
+        module, _, function = handler.rpartition('.')
+        handler = getattr(import_module(module), function)
+        # Keep the function itself, so the name is only looked up once.
+        if isinstance(key, tuple):
+            routes[key] = handler
+        else:
+            fallbacks[key] = handler
+    return handler
+
+
+# Control directives arrive in one namespace and queries in the other,
+# but either may carry any of them - so both accept all of them.
+for namespace in ('Alexa.ConnectedHome.Control', 'Alexa.ConnectedHome.Query'):
+    register(namespace, 'TurnOnRequest', 'handlers.switch_request')
+    register(namespace, 'TurnOffRequest', 'handlers.switch_request')
+    register(namespace, 'SetPercentageRequest', 'handlers.percentage_request')
+    register(namespace, 'IncrementPercentageRequest', 'handlers.percentage_request')
+    register(namespace, 'DecrementPercentageRequest', 'handlers.percentage_request')
+    register(namespace, 'SetColorRequest', 'handlers.colour_request')
+    register(namespace, 'GetTemperatureReadingRequest', 'handlers.current_temperature')
+    register(namespace, 'GetTargetTemperatureRequest', 'handlers.target_temperature')
+    register(namespace, 'SetTargetTemperatureRequest', 'handlers.temperature_request')
+    register(namespace, 'IncrementTargetTemperatureRequest', 'handlers.temperature_request')
+    register(namespace, 'DecrementTargetTemperatureRequest', 'handlers.temperature_request')
+    # An unknown action for a device
+    register_fallback(namespace, 'tools.generate_error')
+register_fallback('Alexa.ConnectedHome.Discovery', 'smarthome.handle_discovery')
@@ -0,0 +1,109 @@
+import argparse
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import handlers  # noqa: F401 - a server can afford to load everything before its first request
+import smarthome  # noqa: F401
+from api import health
+from entrypoint import batch_handler, lambda_handler
+from tools import from_json, to_json
+
+# Self-hosted mode: runs the same handlers as the AWS Lambda, as a long-running HTTP server.
+# Being long-running, the connection pool, discovery cache and state mirror stay warm between requests.
+#
+#   python server.py --host 0.0.0.0 --port 8080 --workers 8
+#
+# POST a directive to / or a list of directives to /batch, and the response is returned as JSON.
+# GET /health answers 200 while OpenHAB can be reached, and 503 while it is treated as down - see breaker.py.
+
+
+# Answers a single HTTP request by passing its JSON body to the handler.
+class BridgeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Seconds an idle keep-alive connection may hold on to a worker.
+    timeout = 10
+    # Send headers and body together, rather than waiting on a delayed ack in between.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        routes = {'/': lambda_handler, '/batch': batch_handler}
+        if self.path not in routes:
+            return self.reply(404, {"error": "Not found"})
+        try:
+            event = from_json(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            return self.reply(400, {"error": "Invalid JSON"})
+        try:
+            response = routes[self.path](event, None)
+        except Exception as e:
+            self.log_error("Error handling %s: %s", self.path, e)
+            return self.reply(500, {"error": "Internal error"})
+        self.reply(200, response)
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.reply(404, {"error": "Not found"})
+        healthy, description = health()
+        self.reply(200 if healthy else 503, {"isHealthy": healthy, "description": description})
+
+    def reply(self, status, body):
+        data = to_json(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# An HTTP server that hands each connection to a fixed pool of worker threads,
+# so a burst of requests can't start an unbounded number of threads.
+class BridgeServer(HTTPServer):
+    def __init__(self, address, workers):
+        super().__init__(address, BridgeRequestHandler)
+        self.workers = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.workers.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    # Stops listening, then waits for the requests already being handled to finish.
+    def server_close(self):
+        super().server_close()
+        self.workers.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve OpenHAB-Echo over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    server = BridgeServer((args.host, args.port), args.workers)
+
+    # shutdown() waits for serve_forever() to return, so it can't be called from the thread running it.
+    def stop(*_):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print("Listening on " + args.host + ":" + str(args.port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    print("Stopped")
+
+
+if __name__ == '__main__':
+    main()
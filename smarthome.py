@@ -1,4 +1,11 @@
-from handlers import *
+import os
+
+from api import backends, fanOut, qualify
+from cache import DiscoveryCache, discovery_cache_file, discovery_max_stale, discovery_ttl
+from capabilities import actions_for, temperature_format, temperature_tags
+from catalog import Catalog
+from items import compact
+from tools import generate_error, generate_response
 
 
 # This method handles discovery events.
@@ -10,117 +17,17 @@ from handlers import *
 
 # All JSON payloads are passed as "event" to handler functions.
 def handle_discovery(event):
-    # get ALL items from the RESTful API, as we are enumerating them.
-    items = getItem("")
+    # The device list is only rebuilt when OpenHAB's items have changed - see cache.py.
+    # With several OpenHAB instances, all of them are asked at once.
+    found = fanOut(DiscoveryCache.get, [(cache,) for cache in discovery_caches.values()])
     # Sanity test for catastrophe. Throw a generic error if we get a malformed payload as there shouldn't be NO items.
-    if not items:
+    if all(devices is None for devices in found):
         return generate_error(event)
-    # Thermostats require special enumeration as they don't exist as a singular item in OpenHAB.
-    # They are a group of three. A setpoint, a current temperature, and a heating/cooling mode string.
-    # The amazon echo expects a single item, so we enumaerate these three and generate a composite.
-    # All three are "tagged" as a thermostat in OpenHAB, so we store those in an array to serialize as a single
-    # object later.
-
-    thermostats = [item for item in items if
-                   item['type'] == 'Group' and 'Thermostat' in item['tags']]
-    # This stores the devices returned in the JSON payload.
-    devices = []
-    # This code defines the actions available to the Echo for a given type in OpenHAB.
-    for item in items:
-        # "tags", in OpenHAB's nomenclature, define the capabilties of an item.
-        # For instance, "Lighting", or "Switchable", which are bulbs and switches in OpenHAB's device list.
-        # These tags translate into different actions to expose to the Echo - so we map them here.
-        for tag in item['tags']:
-            actions = None
-            # Switches and Lights have the same two features to an Echo - they can both be turned on and off.
-            if tag in ('Lighting', 'Switchable'):
-                actionsdict = {
-                    "Switch": [
-                        "turnOn",
-                        "turnOff"
-                    ],
-                    # Dimmers require the handling of percentage events as they are variable.
-                    "Dimmer": [
-                        "incrementPercentage",
-                        "decrementPercentage",
-                        "setPercentage",
-                        "turnOn",
-                        "turnOff"
-                    ],
-                    # Color devices (usually RGB bulbs) require percentages, switching capabilitiy,
-                    # and the ability to set Colour
-                    "Color": [
-                        "incrementPercentage",
-                        "decrementPercentage",
-                        "setPercentage",
-                        "turnOn",
-                        "turnOff",
-                        "setColor"
-                    ],
-                    # Rollershutters are percentage devices only.
-                    "Rollershutter": [
-                        "setPercentage",
-                        "incrementPercentage",
-                        "decrementPercentage"
-                    ]
-                }
-                # set actions for either a group of items of the same type, or a single item.
-                action = item['type']
-                # Set of actions for an item
-                if action in actionsdict:
-                    actions = actionsdict[action]
-                # Set actions for a group
-                elif action == 'Group' and 'groupType' in item and item['groupType'] in actionsdict:
-                    actions = actionsdict[item['groupType']]
-                # No actions available
-                else:
-                    actions = None
-            # Temperature sensors can also exist outside
-            # of a thermostat group. This allows them to work as individual devices
-            # too.
-            elif tag == 'CurrentTemperature':
-                if len([x for x in thermostats if x in item['groupNames']]) == 0:
-                    # if this is not part of a
-                    # Thermostat group, make it available individually
-                    # and define its action.
-                    actions = [
-                        "getTemperatureReading"
-                    ]
-            elif tag == 'Thermostat' and item['type'] == 'Group':
-                # actions available for a thermostat group - a
-                # collection of items that function together as a thermostat.
-                actions = [
-                    "incrementTargetTemperature",
-                    "decrementTargetTemperature",
-                    "setTargetTemperature",
-                    "getTargetTemperature",
-                    "getTemperatureReading"
-                ]
-                # if no actions, there are no items - so don't send a malformed payload
-            if actions:
-                additional_appliance_details = {
-                    "itemType": item['type'],
-                    "itemTag": tag,
-                    "openhabVersion": "2"
-                }
-                # Check temperature format
-                if tag in ('Thermostat', 'CurrentTemperature'):
-                    additional_appliance_details["temperatureFormat"] = "fahrenheit" if "Fahrenheit" in item[
-                        'tags'] or "fahrenheit" in item['tags'] else "celsius"
-                    # To form a complete payload we need to add descriptive information and other such things
-                    # So we add generic "via OpenHAB" descriptions along with the names pulled from OpenHAB
-                devices.append({
-                    "actions": actions,
-                    "applianceId": item['name'],
-                    "manufacturerName": "openHAB",
-                    "modelName": tag,
-                    "version": "2",
-                    "friendlyName": item['label'],
-                    "friendlyDescription": item['type'] + " " + item['name'] + " " + tag + " via openHAB",
-                    "isReachable": True,
-                    "additionalApplianceDetails": additional_appliance_details
-                })
-
+    # An instance that can't be read leaves out its devices, rather than losing everyone else's.
+    for backend, devices in zip(discovery_caches, found):
+        if devices is None:
+            print("Could not discover the devices of " + backend)
+    devices = found[0] if len(found) == 1 else [device for devices in found if devices for device in devices]
     # Return the payload as serialized JSON enumerating the devices
     return {
         'header': generate_response(event, "Response"),
@@ -130,15 +37,82 @@ def handle_discovery(event):
     }
 
 
-# Dispatcher for control events - runs relevant function for payload request
-def handle_control(event):
-    name = event['header']['name']
-    singletons = {
-        "GetTemperatureReadingRequest": current_temperature,
-        "GetTargetTemperatureRequest": target_temperature,
-        "SetColorRequest": colour_request
-    }
-    return switch_request(event) if name in ('TurnOnRequest', 'TurnOffRequest') else singletons[
-        name](event) if name in singletons else percentage_request(
-        event) if "PercentageRequest" in name else temperature_request(
-        event) if "TargetTemperatureRequest" in name else generate_error(event)
+# Translates ALL items from the RESTful API into the devices returned by discovery.
+# backend names the OpenHAB instance the items are from, which becomes part of their applianceIds.
+def build_devices(items, backend=''):
+    return assemble([describe(item, backend) for item in items])
+
+
+# Makes the devices for a single item, as an entry for the Catalog (see catalog.py):
+# (devices, the item's name if it is a thermostat group, the item's groups if it is a temperature sensor)
+def describe(item, backend=''):
+    item = compact(item)
+    # This stores the devices returned in the JSON payload.
+    devices = []
+    # Thermostats require special enumeration as they don't exist as a singular item in OpenHAB.
+    # They are a group of three. A setpoint, a current temperature, and a heating/cooling mode string.
+    # The amazon echo expects a single item, so we enumaerate these three and generate a composite.
+    # All three are "tagged" as a thermostat in OpenHAB, so we store their names to serialize as a single
+    # object later.
+    thermostat = item.name if item.type == 'Group' and item.has('Thermostat') else None
+    groups = None
+    # This code defines the actions available to the Echo for a given type in OpenHAB.
+    for tag in item.tags:
+        actions = actions_for(tag, item)
+        # if no actions, there are no items - so don't send a malformed payload
+        if actions:
+            additional_appliance_details = {
+                "itemType": item.type,
+                "itemTag": tag,
+                "openhabVersion": "2"
+            }
+            # Check temperature format
+            if tag in temperature_tags:
+                additional_appliance_details["temperatureFormat"] = temperature_format(item.tags)
+                # Temperature sensors that are part of a thermostat group get removed by assemble.
+                if tag == 'CurrentTemperature':
+                    groups = item.group_names
+                # To form a complete payload we need to add descriptive information and other such things
+                # So we add generic "via OpenHAB" descriptions along with the names pulled from OpenHAB
+            devices.append({
+                "actions": actions,
+                "applianceId": qualify(backend, item.name),
+                "manufacturerName": "openHAB",
+                "modelName": tag,
+                "version": "2",
+                "friendlyName": item.label,
+                "friendlyDescription": item.type + " " + item.name + " " + tag + " via openHAB",
+                "isReachable": True,
+                "additionalApplianceDetails": additional_appliance_details
+            })
+    return devices, thermostat, groups
+
+
+# Puts together the device list from the entries describe made of every item.
+def assemble(entries):
+    # Whether a temperature sensor belongs to a thermostat is only known once every item has been seen.
+    thermostats = {thermostat for _, thermostat, _ in entries if thermostat}
+    devices = []
+    for found, _, groups in entries:
+        # Remove temperature sensors that are already part of a thermostat device.
+        if groups and not thermostats.isdisjoint(groups):
+            found = [device for device in found if device['modelName'] != 'CurrentTemperature']
+        devices.extend(found)
+    return devices
+
+
+# Where the device catalog of an OpenHAB instance is kept, e.g. /tmp/discovery-garage.json
+def cache_path(backend):
+    if not discovery_cache_file or not backend:
+        return discovery_cache_file
+    root, extension = os.path.splitext(discovery_cache_file)
+    return root + "-" + backend + extension
+
+
+# One for each OpenHAB instance, shared by every invocation the container serves.
+discovery_caches = {
+    backend: DiscoveryCache(Catalog(lambda item, backend=backend: describe(item, backend), assemble), discovery_ttl,
+                            discovery_max_stale, cache_path(backend), backend)
+    for backend in backends
+}
+
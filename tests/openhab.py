@@ -0,0 +1,25 @@
+import os
+import sys
+
+# A fake OpenHAB (see benchmarks/fake_openhab.py) for the tests that handle directives. It is started once, on
+# import, as the clients calling it are shared by every test - load the items a test needs with openhab.load().
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+from fake_openhab import serve  # noqa: E402
+
+server, openhab = serve(items=0, thermostats=0, rooms=0)
+os.environ.update(hostname='127.0.0.1', port=str(server.server_address[1]), user='test', password='test')
+
+
+# A directive as the Echo sends it, for an appliance.
+def directive(namespace, name, appliance, **payload):
+    payload['appliance'] = {'applianceId': appliance, 'additionalApplianceDetails': {}}
+    return {
+        'header': {'namespace': 'Alexa.ConnectedHome.' + namespace, 'name': name, 'payloadVersion': '2',
+                   'messageId': 'test-' + name},
+        'payload': payload
+    }
+
@@ -0,0 +1,50 @@
+import threading
+import unittest
+
+# starts the fake OpenHAB the handlers call
+from openhab import directive, openhab
+
+from coalesce import DeltaCoalescer
+from entrypoint import batch_handler
+from fake_openhab import item
+
+
+class PercentageTest(unittest.TestCase):
+    def setUp(self):
+        openhab.load([item('Light', 'Dimmer', ['Lighting'], '10')])
+        # slow enough that the directives of a batch are all being handled at once
+        openhab.latency = 0.05
+
+    def tearDown(self):
+        openhab.latency = 0.0
+
+    # Changes to the same item made at the same time each add to the others, rather than to the same old state.
+    def test_concurrent_increments_all_apply(self):
+        event = directive('Control', 'IncrementPercentageRequest', 'Light', deltaPercentage={'value': 5})
+        responses = batch_handler({'directives': [event] * 3}, None)
+        self.assertEqual([response['header']['name'] for response in responses],
+                         ['IncrementPercentageConfirmation'] * 3)
+        self.assertEqual(float(openhab.items['Light']['state']), 25)
+
+
+class DeltaCoalescerTest(unittest.TestCase):
+    # A change that fails for the directive making it fails for those that joined it too.
+    def test_failure_reaches_every_change(self):
+        def apply(name, deltas):
+            raise IOError("OpenHAB went away")
+
+        # long enough for the others to join the first change
+        writes = DeltaCoalescer(0.2, apply)
+        results = []
+        leader = threading.Thread(target=self.assertRaises, args=(IOError, writes.submit, 'Light', 5))
+        followers = [threading.Thread(target=lambda: results.append(writes.submit('Light', 5))) for _ in range(2)]
+        leader.start()
+        for follower in followers:
+            follower.start()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(results, ["OpenHAB error"] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
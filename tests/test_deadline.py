@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+# starts the fake OpenHAB the handlers call
+from openhab import directive, openhab
+
+from api import get_client
+from deadline import within
+from fake_openhab import item
+from handlers import target_temperature, temperature_request
+
+
+# What AWS passes a handler, with the time it has left.
+class Context:
+    def __init__(self, milliseconds):
+        self.milliseconds = milliseconds
+
+    def get_remaining_time_in_millis(self):
+        return self.milliseconds
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        openhab.load([
+            item('Heating', 'Group', ['Thermostat'], 'NULL'),
+            item('Heating_Setpoint', 'Number', ['TargetTemperature'], '21', ['Heating']),
+            item('Heating_Temperature', 'Number', ['CurrentTemperature'], '20.5', ['Heating']),
+            item('Heating_Mode', 'Number', ['homekit:HeatingCoolingMode'], '1', ['Heating']),
+        ])
+        # learn the thermostat's members, so that the setpoint and mode are then read at the same time
+        target_temperature(directive('Query', 'GetTargetTemperatureRequest', 'Heating'))
+
+    # Reads made at the same time share a single call's part of the time left, leaving the command its own.
+    def test_parallel_reads_leave_the_command_its_share(self):
+        session = get_client().session
+        timeouts = []
+        request = session.request
+
+        def record(method, url, **kwargs):
+            timeouts.append((method, url.rpartition('/rest/items/')[2], kwargs['timeout']))
+            return request(method, url, **kwargs)
+
+        event = directive('Control', 'IncrementTargetTemperatureRequest', 'Heating', deltaTemperature={'value': 1})
+        # 2 seconds, once deadline_reserve_ms is kept back
+        with mock.patch.object(session, 'request', record), within(Context(2250)):
+            response = temperature_request(event)
+        self.assertEqual(response['header']['name'], 'IncrementTargetTemperatureConfirmation')
+        reads = [timeout for method, _, timeout in timeouts if method == 'GET']
+        self.assertEqual(sorted(name for method, name, _ in timeouts if method == 'GET'),
+                         ['Heating_Mode/state', 'Heating_Setpoint/state'])
+        for timeout in reads:
+            self.assertLessEqual(timeout, 1.0)
+        self.assertEqual([(method, name) for method, name, _ in timeouts if method == 'POST'],
+                         [('POST', 'Heating_Setpoint')])
+        self.assertGreater(timeouts[-1][2], 0.9)
+        self.assertEqual(openhab.items['Heating_Setpoint']['state'], '22.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
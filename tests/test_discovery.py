@@ -0,0 +1,126 @@
+import os
+import random
+import sys
+import unittest
+
+# Checks that discovery describes a large synthetic set of items exactly as the original device builder did.
+#
+#   python -m unittest discover tests
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+from fake_openhab import generate_items, item  # noqa: E402
+from catalog import Catalog  # noqa: E402
+import smarthome  # noqa: E402
+
+# Item kinds, including several tags on one item (each its own device, in the order of the tags), tags
+# that mean nothing here and types that have no actions.
+mix = ('Switch:Switchable=20,Switch:Lighting=10,Switch:Switchable+Lighting=5,Switch:Lighting+Switchable=5,'
+       'Dimmer:Lighting=15,Dimmer:Switchable+Lighting=5,Color:Lighting=8,Color:Lighting+Switchable=3,'
+       'Rollershutter:Switchable=5,Rollershutter:Lighting=2,Number:CurrentTemperature=5,'
+       'Number:CurrentTemperature+Fahrenheit=2,Number:Fahrenheit+CurrentTemperature=1,'
+       'Number:CurrentTemperature+fahrenheit=1,Number:TargetTemperature=1,Number:Lighting=2,'
+       'String:Switchable=1,Number=5,String=3,Switch:Unknown+Switchable=2')
+
+
+# The device builder discovery started from, kept as it was so that its output can be compared.
+# The one change is that temperature sensors are left out by the names of the thermostat groups they are in - as
+# written, it compared item dicts against the group names and never matched.
+def reference_devices(items):
+    thermostats = {entry['name'] for entry in items if entry['type'] == 'Group' and 'Thermostat' in entry['tags']}
+    devices = []
+    for entry in items:
+        for tag in entry['tags']:
+            actions = None
+            if tag in ('Lighting', 'Switchable'):
+                actionsdict = {
+                    "Switch": ["turnOn", "turnOff"],
+                    "Dimmer": ["incrementPercentage", "decrementPercentage", "setPercentage", "turnOn", "turnOff"],
+                    "Color": ["incrementPercentage", "decrementPercentage", "setPercentage", "turnOn", "turnOff",
+                              "setColor"],
+                    "Rollershutter": ["setPercentage", "incrementPercentage", "decrementPercentage"]
+                }
+                action = entry['type']
+                if action in actionsdict:
+                    actions = actionsdict[action]
+                elif action == 'Group' and 'groupType' in entry and entry['groupType'] in actionsdict:
+                    actions = actionsdict[entry['groupType']]
+            elif tag == 'CurrentTemperature':
+                if thermostats.isdisjoint(entry['groupNames']):
+                    actions = ["getTemperatureReading"]
+            elif tag == 'Thermostat' and entry['type'] == 'Group':
+                actions = ["incrementTargetTemperature", "decrementTargetTemperature", "setTargetTemperature",
+                           "getTargetTemperature", "getTemperatureReading"]
+            if actions:
+                additional_appliance_details = {
+                    "itemType": entry['type'],
+                    "itemTag": tag,
+                    "openhabVersion": "2"
+                }
+                if tag in ('Thermostat', 'CurrentTemperature'):
+                    additional_appliance_details["temperatureFormat"] = "fahrenheit" if "Fahrenheit" in entry[
+                        'tags'] or "fahrenheit" in entry['tags'] else "celsius"
+                devices.append({
+                    "actions": actions,
+                    "applianceId": entry['name'],
+                    "manufacturerName": "openHAB",
+                    "modelName": tag,
+                    "version": "2",
+                    "friendlyName": entry['label'],
+                    "friendlyDescription": entry['type'] + " " + entry['name'] + " " + tag + " via openHAB",
+                    "isReachable": True,
+                    "additionalApplianceDetails": additional_appliance_details
+                })
+    return devices
+
+
+# Generated items, along with the kinds generate_items doesn't make: groups of other types, a Fahrenheit
+# thermostat, sensors in groups that aren't thermostats and a thermostat tag on an item that isn't a group.
+def synthetic_items(count=30000, seed=1):
+    items = generate_items(count, thermostats=200, rooms=50, mix=mix, seed=seed)
+    rng = random.Random(seed)
+    for i in range(50):
+        items.append(item('SwitchGroup%d' % i, 'Group', ['Switchable'], 'ON', group_type='Switch'))
+        items.append(item('ShutterGroup%d' % i, 'Group', ['Lighting', 'Switchable'], '0', group_type='Rollershutter'))
+        items.append(item('PlainGroup%d' % i, 'Group', ['Lighting'], 'NULL'))
+        items.append(item('Outside%d' % i, 'Number', ['CurrentTemperature'], '10', ['Room%d' % rng.randrange(50)]))
+        items.append(item('NotAGroup%d' % i, 'Number', ['Thermostat'], '20'))
+    items.append(item('Attic', 'Group', ['Thermostat', 'Fahrenheit'], 'NULL'))
+    items.append(item('Attic_Temperature', 'Number', ['CurrentTemperature', 'Fahrenheit'], '70', ['Attic', 'Room1']))
+    rng.shuffle(items)
+    return items
+
+
+class DiscoveryTest(unittest.TestCase):
+    # Compares device lists one device at a time, as a diff of two whole lists this long would take minutes.
+    def assertDevices(self, devices, expected):
+        for position, (device, wanted) in enumerate(zip(devices, expected)):
+            self.assertEqual(device, wanted, "device %d differs" % position)
+        self.assertEqual(len(devices), len(expected))
+
+    def test_matches_reference(self):
+        items = synthetic_items()
+        devices = smarthome.build_devices(items)
+        self.assertGreater(len(devices), len(items) // 2)
+        self.assertDevices(devices, reference_devices(items))
+
+    # The catalog only describes again the items that changed, which must give the same devices as starting over.
+    def test_catalog_matches_reference_after_changes(self):
+        items = synthetic_items(5000)
+        catalog = Catalog(smarthome.describe, smarthome.assemble)
+        self.assertDevices(catalog.update(items), reference_devices(items))
+        rng = random.Random(2)
+        changed = [dict(entry) for entry in items]
+        for entry in rng.sample(changed, 500):
+            entry['tags'] = list(reversed(entry['tags']))
+            entry['label'] = entry['label'] + ' moved'
+        # losing a thermostat group brings its temperature sensor back as a device of its own
+        changed = [entry for entry in changed if entry['name'] != 'Thermostat0']
+        changed.append(item('Extra', 'Dimmer', ['Lighting'], '0'))
+        self.assertDevices(catalog.update(changed), reference_devices(changed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+
+from api import current_backend
+from items import compact
+from mirror import readItem, readStates
+from tools import generate_thermostat
+
+# Optional: seconds to remember which member of a thermostat group is its setpoint, temperature and mode
+# (default 300). Until then, thermostat directives read only the states of the members they need.
+thermostat_ttl = float(os.environ.get('thermostat_ttl', 300))
+
+
+# Remembers the members making up each thermostat, as {'targetTemperature': 'Heating_Setpoint', ...}
+# under (OpenHAB instance, name of the group). A lone temperature sensor is remembered as its own 'currentTemperature'.
+class ThermostatRoles:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.roles = {}
+        self.lock = threading.Lock()
+
+    # Returns the remembered parts of a thermostat, or None if they aren't known or are too old.
+    def get(self, key):
+        entry = self.roles.get(key)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def remember(self, key, roles):
+        with self.lock:
+            self.roles[key] = (roles, time.time())
+
+    def invalidate(self, key):
+        with self.lock:
+            self.roles.pop(key, None)
+
+
+# Shared by every invocation the container serves.
+thermostat_roles = ThermostatRoles(thermostat_ttl)
+
+
+# Reads the current state of parts of a thermostat, e.g. readThermostat('Heating', 'targetTemperature').
+# Returns ({part: member name}, {part: state}) for those parts the thermostat has, or None if there's no such item.
+# When the members are already known, only their states are read, and otherwise the whole group is.
+def readThermostat(name, *parts):
+    key = (current_backend.get(), name)
+    roles = thermostat_roles.get(key)
+    if roles is not None:
+        wanted = [part for part in parts if part in roles]
+        states = readStates([roles[part] for part in wanted])
+        if False not in states:
+            return roles, dict(zip(wanted, states))
+        # a member couldn't be read - it may have been renamed or removed, so look at the group again
+        thermostat_roles.invalidate(key)
+
+    item = readItem(name)
+    if not item:
+        return None
+    if item['type'] == "Group":
+        # A thermostat in OpenHAB consists of several items - temp monitor, setpoint etc
+        members = generate_thermostat([compact(member) for member in item['members']])
+    else:
+        members = {'currentTemperature': compact(item)}
+    roles = {part: member.name for part, member in members.items()}
+    thermostat_roles.remember(key, roles)
+    return roles, {part: members[part].state for part in parts if part in members}
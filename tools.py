@@ -1,3 +1,5 @@
+import json
+
 # Heating/Cooling modes are expressed as numbers in OpenHAB but the response is textual JSON.
 # The "heat-cool" tag is there because if an OpenHAB user has configured their setup to work with HomeKit tags
 # This will harmlessly ignore the heat/cooling mode by passing the generic "AUTO" tag.
@@ -21,23 +23,28 @@ def is_fahrenheit(event):
            event['payload']['appliance']['additionalApplianceDetails']['temperatureFormat'] == 'fahrenheit'
 
 
+# The parts of an error header that are the same every time.
+error_header = {
+    "namespace": "Alexa.ConnectedHome.Control",
+    "name": "DependentServiceUnavailableError",
+    "payloadVersion": "2"
+}
+
+
 # Generates generic error for when more info isn't available
 def generate_error(event, error="OpenHAB error"):
-    return {'header': {
-        "namespace": "Alexa.ConnectedHome.Control",
-        "name": "DependentServiceUnavailableError",
-        "payloadVersion": "2",
-        "messageID": event['header']['messageId']
-    },
-        'payload': {
-            "dependentServiceName": error
-        }
-    }
+    header = dict(error_header)
+    header["messageID"] = event['header']['messageId']
+    return {'header': header,
+            'payload': {
+                "dependentServiceName": error
+            }
+            }
 
 
 # Gathers a group of OpenHAB items (temp setpoint, current temp, mode)
 # and creates a single device out of them for Alexa
-# Arguments - group - item tag group from OpenHAB.
+# Arguments - group - the members of a thermostat group from OpenHAB, as Items (see items.py).
 def generate_thermostat(group):
     # Thermostat object we are building
     thermo = {}
@@ -49,23 +56,32 @@ def generate_thermostat(group):
         "homekit:HeatingCoolingMode": "heatingCoolingMode"
     }
     for item in group:
-        for tag in item['tags']:
-            if tag in tags:
-                thermo[tags[tag]] = item
+        for tag, part in tags.items():
+            if item.has(tag):
+                thermo[part] = item
     return thermo
 
 
+# Response headers already generated, by (request namespace, request name, response).
+# There are only a handful of these, so each is only built once.
+response_headers = {}
+
+
 # This method generates the boilerplate JSON for responses and is invoked
 # to give a successful response.
 # Arguments: event - incoming payload, along with the response - name
 # Generates response to received payload.
 def generate_response(event, name):
     header = event['header']
-    ret = {
-        "name": header['name'].replace("Request", name),
-        "namespace": header['namespace'],
-        "payloadVersion": "2"
-    }
+    key = (header['namespace'], header['name'], name)
+    template = response_headers.get(key)
+    if template is None:
+        template = response_headers[key] = {
+            "name": header['name'].replace("Request", name),
+            "namespace": header['namespace'],
+            "payloadVersion": "2"
+        }
+    ret = dict(template)
     # if the response contains a message, add it to the payload.
     if "messageId" in header:
         ret['messageId'] = header['messageId']
@@ -79,3 +95,29 @@ def convert_to_c(number):
 
 def convert_to_f(number):
     return 9.0 / 5.0 * number + 32
+
+
+# (serialise, parse) functions - orjson's when it is installed, as it is several times faster than
+# the json module. Importing it takes a while, so it is looked for by the first call rather than at startup.
+json_codec = None
+
+
+def get_json_codec():
+    global json_codec
+    if json_codec is None:
+        try:
+            import orjson
+            json_codec = (lambda value: orjson.dumps(value).decode('utf-8'), orjson.loads)
+        except ImportError:
+            json_codec = (json.dumps, json.loads)
+    return json_codec
+
+
+# Serialises to a JSON string, quickly if orjson is installed.
+def to_json(value):
+    return get_json_codec()[0](value)
+
+
+# Parses a JSON string or bytes, quickly if orjson is installed.
+def from_json(data):
+    return get_json_codec()[1](data)